@@ -3,7 +3,6 @@
 # @MAKEAPPX:AUTOSTART@
 import logging
 import os
-import sqlite3
 import sys
 import threading
 import tkinter as tk
@@ -14,7 +13,7 @@ import pystray
 import win32timezone  # pyinstaller will miss it otherwise
 from windows_toasts import WindowsToaster
 
-from host_checker import common
+from host_checker import common, db, notifications
 from host_checker.config_cksums_window import ConfigCksumsWindow
 from host_checker.config_hosts_window import ConfigHostsWindow
 from host_checker.config_window import ConfigWindow
@@ -25,15 +24,6 @@ from ui.licenses_window import LicensesWindow
 from ui.tkless import TkLess
 
 
-def init_db():
-    con = sqlite3.connect(str(common.DB_PATH))
-    with con:
-        con.execute("CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, battery_threshold INTEGER, storage_threshold INTEGER, port INTEGER)")
-        con.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
-        con.execute("CREATE TABLE IF NOT EXISTS task_status (filename TEXT PRIMARY KEY, timeout_hours INTEGER, last_run TIMESTAMP, status TEXT)")
-        con.execute("CREATE TABLE IF NOT EXISTS checksum_files (path TEXT, last_check TIMESTAMP, status TEXT, host TEXT DEFAULT '', PRIMARY KEY (host, path))")
-    con.close()
-
 def on_autostart_registry():
     try:
         os.startfile("ms-settings:startupapps")
@@ -70,23 +60,25 @@ def main():
         sys.exit(1)
 
     try:
-        init_db()
+        db.init_db()
     except Exception as ex:
         logging.exception(ex)
         sys.exit(1)
 
+    notifications.notifier.sinks = [notifications.ToastSink(common.toaster)]
+    try:
+        notify_file = db.get_setting('notify_file')
+        if notify_file:
+            notifications.notifier.sinks.append(notifications.FileSink(notify_file))
+    except Exception:
+        pass
+
     root = tk.Tk()
     root.withdraw()
 
     update_check_enabled = True
     try:
-        con = sqlite3.connect(str(common.DB_PATH))
-        cur = con.cursor()
-        cur.execute("SELECT value FROM settings WHERE key='update_check_enabled'")
-        row = cur.fetchone()
-        if row:
-            update_check_enabled = (row[0] == '1')
-        con.close()
+        update_check_enabled = (db.get_setting('update_check_enabled', '1') == '1')
     except Exception:
         pass
 
@@ -95,7 +87,7 @@ def main():
         uc.start()
 
     check_event = threading.Event()
-    shutdown_event = threading.Event()
+    shutdown_event = common.shutdown_event
 
     icon = pystray.Icon(common.APPNAME, common.create_icon('ok'), f"{common.APPNAME} {common.APP_VERSION}")
     
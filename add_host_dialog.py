@@ -1,7 +1,7 @@
-import sqlite3
 import tkinter as tk
 from tkinter import messagebox
 
+from host_checker import db
 from ui.tools import Tools
 
 
@@ -44,14 +44,13 @@ class AddHostDialog:
         host = self.host_var.get().strip()
         if not host: return
         try:
-            con = sqlite3.connect(str(self.db_path))
+            con = db.connect(self.db_path)
             with con:
                 if self.current_data and self.current_data[0] != host:
                     con.execute("DELETE FROM hosts WHERE host = ?", (self.current_data[0],))
                 
                 con.execute("INSERT OR REPLACE INTO hosts (host, battery_threshold, storage_threshold, port) VALUES (?, ?, ?, ?)", 
                             (host, self.batt_var.get(), self.store_var.get(), self.port_var.get()))
-            con.close()
             self.callback()
             self.top.destroy()
         except Exception as e:
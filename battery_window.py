@@ -1,23 +1,65 @@
 import datetime
-import re
 import tkinter as tk
 from tkinter import messagebox
 
 import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from matplotlib.figure import Figure
 
+import host_checker.samples as samples
 from ui.tools import Tools
 
 
+SEGMENT_MAX_GAP = 7200
+SEGMENT_MIN_DROP = 1
+SEGMENT_MIN_HOURS = 0.5
+# plotted points per horizontal pixel bucket (its min and max)
+DEFAULT_PLOT_WIDTH = 1000
+
+
+def find_discharge_slopes(ts, pcts, discharging) -> np.ndarray:
+    # Drain rates in %/h of all discharge segments, given time-sorted epoch seconds, percentages
+    # and a DISCHARGING mask. A segment is a run of consecutive discharging samples that are less
+    # than SEGMENT_MAX_GAP apart and never rise in percentage; it counts if it has at least two
+    # samples, drops at least SEGMENT_MIN_DROP percent and spans at least SEGMENT_MIN_HOURS.
+    idx = np.flatnonzero(discharging)
+    if idx.size == 0:
+        return np.empty(0)
+    cur, prev = idx[1:], idx[:-1]
+    continues = (cur - prev == 1) & (ts[cur] - ts[prev] < SEGMENT_MAX_GAP) & (pcts[cur] <= pcts[prev])
+    starts = np.flatnonzero(np.concatenate(([True], ~continues)))
+    ends = np.append(starts[1:] - 1, idx.size - 1)
+
+    counts = np.add.reduceat(np.ones(idx.size, dtype=np.int64), starts)
+    first, last = idx[starts], idx[ends]
+    hours = (ts[last] - ts[first]) / 3600.0
+    drops = pcts[first] - pcts[last]
+    valid = (counts >= 2) & (drops >= SEGMENT_MIN_DROP) & (hours >= SEGMENT_MIN_HOURS)
+    return drops[valid] / hours[valid]
+
+
+def downsample_minmax(x, y, buckets) -> np.ndarray:
+    # Indices of the points to plot: the first and last point and the minimum and maximum
+    # of each of `buckets` equally sized runs, so spikes and drops survive the reduction.
+    n = len(x)
+    if n <= 2 * buckets:
+        return np.arange(n)
+    size = n // buckets
+    body = y[:size * buckets].reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    keep = [offsets + body.argmin(axis=1), offsets + body.argmax(axis=1), [0, n - 1]]
+    tail = y[size * buckets:]
+    if tail.size:
+        keep.append([size * buckets + tail.argmin(), size * buckets + tail.argmax()])
+    return np.unique(np.concatenate(keep))
+
+
 class BatteryAnalysisWindow:
-    def __init__(self, parent, host, log_path):
+    def __init__(self, parent, host):
         self.top = tk.Toplevel(parent)
         self.top.title(f"Battery Analysis: {host}")
         self.host = host
-        self.log_path = log_path
-        self.canvas = None
         
         # Controls
         ctrl_frame = tk.Frame(self.top)
@@ -37,61 +79,53 @@ class BatteryAnalysisWindow:
         self.plot_frame = tk.Frame(self.top)
         self.plot_frame.pack(fill=tk.BOTH, expand=True)
         
+        # The figure and line are created once and updated in place on refresh and zoom.
+        # Figure is used instead of pyplot so nothing is kept alive in pyplot's figure registry.
+        self.fig = Figure(figsize=(8, 5), dpi=100)
+        self.ax = self.fig.add_subplot()
+        self.line, = self.ax.plot([], [], marker='.', linestyle='-', markersize=2, label='Battery %')
+        self.ax.set_title(f"Battery History: {self.host}")
+        self.ax.set_ylabel("Percentage")
+        self.ax.set_xlabel("Time")
+        self.ax.grid(True)
+        self.ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d %H:%M'))
+        self.fig.autofmt_xdate()
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.plot_frame)
+        NavigationToolbar2Tk(self.canvas, self.plot_frame).update()
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
+        self._autoscaling = False
+        self._zoom_job = None
+        
         Tools.center_window(self.top, 900, 700)
         self.analyze()
         
     def analyze(self):
         days = self.days_var.get()
-        cutoff = datetime.datetime.now() - datetime.timedelta(days=days) if days > 0 else datetime.datetime.min
-        
-        data = [] # (time, pct, status)
-        pattern = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d+ - .* - INFO - " + re.escape(self.host) + r": Battery (\d+)% \((.*)\)")
+        since = (datetime.datetime.now() - datetime.timedelta(days=days)).timestamp() if days > 0 else None
         
         try:
-            with open(self.log_path, 'r', encoding='utf-8', errors='ignore') as f:
-                for line in f:
-                    m = pattern.match(line)
-                    if m:
-                        dt_str, pct_str, status = m.groups()
-                        dt = datetime.datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
-                        if dt >= cutoff:
-                            data.append((dt, int(pct_str), status))
+            rows = samples.query_samples(self.host, since)
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to read log: {e}")
+            messagebox.showerror("Error", f"Failed to load samples: {e}")
             return
 
-        if not data:
+        if not rows:
             self.stats_lbl.config(text="No data found for this host in the specified period.")
-            if self.canvas: self.canvas.get_tk_widget().destroy()
-            self.canvas = None
+            self.line.set_data([], [])
+            self.canvas.draw_idle()
             return
 
-        data.sort(key=lambda x: x[0])
-        
-        slopes = []
-        current_segment = []
-        
-        for i in range(len(data)):
-            dt, pct, status = data[i]
-            if status == 'DISCHARGING':
-                if not current_segment:
-                    current_segment.append(data[i])
-                else:
-                    last_dt, last_pct, _ = current_segment[-1]
-                    if (dt - last_dt).total_seconds() < 7200 and pct <= last_pct:
-                        current_segment.append(data[i])
-                    else:
-                        self.process_segment(current_segment, slopes)
-                        current_segment = [data[i]]
-            else:
-                if current_segment:
-                    self.process_segment(current_segment, slopes)
-                    current_segment = []
-        
-        if current_segment:
-            self.process_segment(current_segment, slopes)
+        ts, pcts, statuses = zip(*rows)
+        ts = np.asarray(ts, dtype=np.float64)
+        pcts = np.asarray(pcts, dtype=np.int64)
+        discharging = np.asarray(statuses) == 'DISCHARGING'
+        order = np.argsort(ts, kind='stable')
+        ts, pcts, discharging = ts[order], pcts[order], discharging[order]
+
+        slopes = find_discharge_slopes(ts, pcts, discharging)
             
-        if slopes:
+        if slopes.size:
             avg_slope = np.mean(slopes) # %/hr
             std_slope = np.std(slopes)
             if avg_slope > 0:
@@ -106,32 +140,47 @@ class BatteryAnalysisWindow:
             stats_text = "No valid discharge segments found for analysis."
             
         self.stats_lbl.config(text=stats_text)
-        self.plot(data)
-
-    def process_segment(self, segment, slopes):
-        if len(segment) < 2: return
-        start_dt, start_pct, _ = segment[0]
-        end_dt, end_pct, _ = segment[-1]
-        duration_hours = (end_dt - start_dt).total_seconds() / 3600.0
-        drop = start_pct - end_pct
-        if drop >= 1 and duration_hours >= 0.5:
-            slope = drop / duration_hours
-            slopes.append(slope)
-
-    def plot(self, data):
-        if self.canvas:
-            self.canvas.get_tk_widget().destroy()
-        
-        fig, ax = plt.subplots(figsize=(8, 5), dpi=100)
-        times = [x[0] for x in data]
-        pcts = [x[1] for x in data]
-        ax.plot(times, pcts, marker='.', linestyle='-', markersize=2, label='Battery %')
-        ax.set_title(f"Battery History: {self.host}")
-        ax.set_ylabel("Percentage")
-        ax.set_xlabel("Time")
-        ax.grid(True)
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d %H:%M'))
-        fig.autofmt_xdate()
-        self.canvas = FigureCanvasTkAgg(fig, master=self.plot_frame)
-        self.canvas.draw()
-        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
\ No newline at end of file
+        self.plot(ts, pcts)
+
+    def plot(self, ts, pcts):
+        self.set_line_data(ts, pcts)
+        self._autoscaling = True
+        try:
+            self.ax.relim()
+            self.ax.autoscale_view()
+        finally:
+            self._autoscaling = False
+        self.canvas.draw_idle()
+
+    def set_line_data(self, ts, pcts):
+        buckets = max(self.canvas.get_tk_widget().winfo_width(), DEFAULT_PLOT_WIDTH // 2)
+        keep = downsample_minmax(ts, pcts, buckets)
+        # matplotlib dates are naive local times here, like the rest of the UI
+        times = mdates.date2num([datetime.datetime.fromtimestamp(t) for t in ts[keep]])
+        self.line.set_data(times, pcts[keep])
+
+    def on_xlim_changed(self, ax):
+        if self._autoscaling:
+            return
+        # zooming and panning fire many events; only re-fetch once the view settles
+        if self._zoom_job is not None:
+            self.top.after_cancel(self._zoom_job)
+        self._zoom_job = self.top.after(200, self.refetch_visible)
+
+    def refetch_visible(self):
+        self._zoom_job = None
+        if not self.top.winfo_exists():
+            return
+        x0, x1 = self.ax.get_xlim()
+        since = mdates.num2date(x0).replace(tzinfo=None).timestamp()
+        until = mdates.num2date(x1).replace(tzinfo=None).timestamp()
+        try:
+            rows = samples.query_samples(self.host, since, until)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load samples: {e}")
+            return
+        if not rows:
+            return
+        ts, pcts, _ = zip(*rows)
+        self.set_line_data(np.asarray(ts, dtype=np.float64), np.asarray(pcts, dtype=np.int64))
+        self.canvas.draw_idle()
@@ -1,108 +1,230 @@
 import ctypes
 import datetime
 import glob
-import hashlib
 import json
 import logging
 import os
-import sqlite3
+import re
+import socket
 import string
-import subprocess
-import sys
 import time
 from pathlib import Path
 
 import host_checker.common as common
+import host_checker.db as db
+import host_checker.notifications as notifications
+import host_checker.samples as samples
+import host_checker.scheduler as scheduler
+from host_checker.daemon_pool import DaemonThreadPool
+from host_checker.hashing import (DEFAULT_CACHE_MAX_AGE_DAYS, DEFAULT_LOW_PRIORITY, DEFAULT_MAX_DEVICES, DEFAULT_PAUSE_LOAD_PCT, DEFAULT_RATE_LIMIT_MB,
+                                  DEFAULT_RESUMABLE_MIN_MB, QUICK_SAMPLE_SIZE, HashCache, HashCheckpoints, HashEngine, Throttle, lower_thread_priority,
+                                  manifest_size, parse_manifest_lines, quick_check, sample_digest)
+from host_checker.remote_batch import RemoteBatch
+from host_checker.ssh_pool import SshSessionPool
 
-def _get_ssh_cmd(host, port=8022, key_file=None, remote_cmd=None) -> list[str]:
-    cmd = [
-        "ssh",
-        "-p", str(port),
-        "-o", "ConnectTimeout=55",
-        "-o", "BatchMode=yes",
-    ]
-    if key_file:
-        cmd.extend(["-i", key_file])
-    cmd.append(f"root@{host}")
-    if remote_cmd:
-        cmd.append(remote_cmd)
-    return cmd
-
-def check_host(host, port, battery_threshold, storage_threshold, key_file=None):
-    cmd =_get_ssh_cmd(host, port, key_file, "termux-battery-status; echo '|||'; df -kP /storage/emulated; echo '|||'; find storage/shared/backup/ -type f -iname '*.sha256' 2>/dev/null ||:")
-    
-    try:
-        logging.info(f"Checking {host}...")
-        startupinfo = None
-        if sys.platform == 'win32':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+DEFAULT_HOST_CHECK_CONCURRENCY = 8
+DEFAULT_HOST_CHECK_TIMEOUT = 60
+DEFAULT_HOST_CHECK_INTERVAL = 1800
+DEFAULT_TASK_CHECK_INTERVAL = 1800
+DEFAULT_CHECKSUM_CHECK_INTERVAL = 1800
+# shortest interval the checks run at, whatever is configured
+MIN_CHECK_INTERVAL = 60
+# quick checks read the sampled blocks of each passing file about once per this many seconds
+QUICK_SAMPLE_PERIOD = 86400
+DEFAULT_CHECKSUM_RECHECK_DAYS = 7
+DEFAULT_CHECKSUM_BUDGET_GB = 100
+# time a host's session may additionally spend on remote manifests per cycle; unfinished ones
+# continue where they stopped next cycle
+REMOTE_CHECKSUM_TIMEOUT = 300
+# remote results are written to the db in batches of this many entries
+REMOTE_RESULT_BATCH = 64
+# entries of a remote manifest stored at a time while it's read
+REMOTE_MANIFEST_BATCH = 1024
+# exit code of a remote manifest read for a manifest that doesn't exist
+REMOTE_MISSING_EXIT = 3
+# a host's port is probed with a plain TCP connect before ssh is started; 0 disables the probe
+DEFAULT_HOST_PROBE_TIMEOUT = 3
+# unreachable hosts are skipped for one host check interval, doubled with every further failure
+# up to the maximum, until they answer again
+DEFAULT_HOST_BACKOFF_MAX = 6 * 3600
+# share of the interval a run may come before the end of a backoff and still probe, as the
+# scheduler's jitter moves runs by up to 10% of the interval
+HOST_BACKOFF_SLACK = 0.25
 
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, startupinfo=startupinfo, timeout=60)
-        output = result.stdout.strip()
-        
-        if not output:
-            logging.warning(f"{host}: No output received.")
+ssh_sessions = SshSessionPool()
+
+def check_host(host, port, battery_threshold, storage_threshold, key_file=None, timeout=DEFAULT_HOST_CHECK_TIMEOUT):
+    # Everything due for the host runs in one batched ssh session: the battery and storage metrics,
+    # the manifest listing and the verification of due remote manifests. Hosts that didn't answer
+    # lately are skipped until their backoff ends, so they are never checked more often than others.
+    now = time.time()
+    failures, retry_at = _host_backoff(host)
+    # a forced run, like "Check Now", still probes the host but ignores its backoff
+    if retry_at and retry_at - now > _host_check_interval() * HOST_BACKOFF_SLACK and not scheduler.run_forced():
+        logging.info(f"{host}: unreachable {failures} times, skipped until {time.strftime('%H:%M', time.localtime(retry_at))}")
+        return
+    probe_timeout = get_int_setting('host_probe_timeout', DEFAULT_HOST_PROBE_TIMEOUT)
+    reachable = _probe_host(host, port, probe_timeout) if probe_timeout > 0 else None
+    if reachable is False:
+        _record_reachability(host, False)
+        return
+
+    con = db.connect()
+    due = con.execute("SELECT path, status, next_due, sweep_started FROM checksum_files WHERE host = ? AND (status != 'ok' OR COALESCE(next_due, 0) <= ?) ORDER BY COALESCE(next_due, 0)",
+                      (host, now)).fetchall()
+    sweeps = []
+    for path, status, next_due, sweep_started in due:
+        # a failing manifest that isn't due for a full pass: only re-verify its failed entries
+        retry = (status == 'failed' and (next_due or 0) > now and sweep_started is None
+                 and con.execute("SELECT 1 FROM checksum_entries WHERE host = ? AND manifest = ? AND status != 'ok' LIMIT 1", (host, path)).fetchone() is not None)
+        sweeps.append(RemoteSweep(host, path, retry))
+
+    results = {}
+    batch = RemoteBatch()
+    batch.add('battery', "termux-battery-status")
+    batch.add('storage', "df -kP /storage/emulated")
+    batch.add('checksums', "find storage/shared/backup/ -type f -iname '*.sha256' 2>/dev/null ||:")
+    for i, sweep in enumerate(sweeps):
+        sweep.add_to(batch, f"manifest{i}")
+    session_timeout = timeout + (REMOTE_CHECKSUM_TIMEOUT if sweeps else 0)
+
+    def battery_done(code, output):
+        try:
+            data = json.loads(output)
+        except json.JSONDecodeError:
+            logging.error(f"Failed to check {host}: Invalid JSON output received.")
             return
+        results['percentage'] = percentage = data.get("percentage", 0)
+        results['status'] = status = data.get("status", "UNKNOWN")
+        logging.info(f"{host}: Battery {percentage}% ({status})")
+        problems = {}
+        if percentage < battery_threshold and status != "CHARGING":
+            problems[host] = ('low', f"Battery Low: {host}\nCharge: {percentage}% Status: {status}")
+        notifications.report(f"battery:{host}", problems)
 
-        parts = output.split('|||')
-        battery_out = parts[0].strip()
-        storage_out = parts[1].strip() if len(parts) > 1 else ""
-        checksums_out = parts[2].strip() if len(parts) > 2 else None
+    def storage_done(code, output):
+        try:
+            lines = output.splitlines()
+            if len(lines) > 1:
+                vals = lines[-1].split()
+                results['free_mb'] = free_mb = int(vals[3]) / 1024
+                logging.info(f"{host}: Storage {free_mb:.0f} MB free")
+                problems = {}
+                if free_mb < storage_threshold:
+                    problems[host] = ('low', f"Low Storage: {host}\nFree Space: {free_mb:.0f} MB")
+                notifications.report(f"storage:{host}", problems)
+        except Exception as e:
+            logging.error(f"Failed to parse storage for {host}: {e}")
 
-        if battery_out:
-            try:
-                data = json.loads(battery_out)
-                percentage = data.get("percentage", 0)
-                status = data.get("status", "UNKNOWN")
-                
-                logging.info(f"{host}: Battery {percentage}% ({status})")
-                
-                if percentage < battery_threshold and status != "CHARGING":
-                    common.show_warning(f"Battery Low: {host}\nCharge: {percentage}% Status: {status}")
-            except json.JSONDecodeError:
-                logging.error(f"Failed to check {host}: Invalid JSON output received.")
-
-        if storage_out:
-            try:
-                lines = storage_out.splitlines()
-                if len(lines) > 1:
-                    vals = lines[-1].split()
-                    free_mb = int(vals[3]) / 1024
-                    logging.info(f"{host}: Storage {free_mb:.0f} MB free")
-                    if free_mb < storage_threshold:
-                        common.show_warning(f"Low Storage: {host}\nFree Space: {free_mb:.0f} MB")
-            except Exception as e:
-                logging.error(f"Failed to parse storage for {host}: {e}")
+    def checksums_done(code, output):
+        try:
+            added, removed = reconcile_remote_checksum_files(host, output.splitlines())
+            if added:
+                logging.info(f"Found {added} new remote checksum files on {host}")
+            if removed:
+                logging.warning(f"{removed} remote checksum files missing on {host}")
+        except Exception as e:
+            logging.error(f"Failed to process checksums for {host}: {e}")
 
-        if checksums_out is not None:
+    handlers = {'battery': battery_done, 'storage': storage_done, 'checksums': checksums_done}
+    for i, sweep in enumerate(sweeps):
+        handlers[f"manifest{i}_read"] = sweep.manifest_read
+
+    def record_sample():
+        if 'percentage' in results or 'free_mb' in results:
             try:
-                found_paths = set(line.strip() for line in checksums_out.splitlines() if line.strip())
-                con = sqlite3.connect(str(common.DB_PATH))
-                with con:
-                    cur = con.cursor()
-                    cur.execute("SELECT path FROM checksum_files WHERE host = ?", (host,))
-                    existing_paths = set(row[0] for row in cur.fetchall())
-                    
-                    for p in found_paths:
-                        if p not in existing_paths:
-                            con.execute("INSERT OR IGNORE INTO checksum_files (path, last_check, status, host) VALUES (?, 0, 'pending', ?)", (p, host))
-                            logging.info(f"Found new remote checksum file: {p} on {host}")
-                    
-                    for p in existing_paths:
-                        if p not in found_paths:
-                            con.execute("UPDATE checksum_files SET status = 'missing' WHERE path = ? AND host = ?", (p,host))
-                            logging.warning(f"Remote checksum file missing: {p} on {host}")
-                con.close()
+                samples.record_sample(host, results.get('percentage'), results.get('status'), results.get('free_mb'))
             except Exception as e:
-                logging.error(f"Failed to process checksums for {host}: {e}")
+                logging.error(f"Failed to record samples for {host}: {e}")
 
-    except subprocess.TimeoutExpired:
-        logging.error(f"Failed to check {host}: SSH command timed out.")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to check {host}: SSH command failed. {e.stderr.strip()}")
+    finished = []
+    try:
+        logging.info(f"Checking {host}...")
+        for name, code, output in ssh_sessions.run_batch(batch, host, port, key_file, max(5, timeout - 5), session_timeout):
+            finished.append(name)
+            if name in handlers:
+                handlers[name](code, output.strip())
+            if name == 'storage':
+                # don't hold the sample back until the remote verifications are done
+                record_sample()
+        if not finished:
+            logging.error(f"Failed to check {host}: SSH command failed. {batch.stderr.strip()}")
+        elif len(finished) < len(batch.commands):
+            logging.warning(f"{host}: session ended after {len(finished)} of {len(batch.commands)} commands")
     except Exception as e:
         logging.error(f"Failed to check {host}: {e}")
+    if 'storage' not in finished:
+        record_sample()
+
+    for sweep in sweeps:
+        try:
+            sweep.finish()
+        except Exception as e:
+            logging.error(f"Failed to record remote checksums of {sweep.path} on {host}: {e}")
+    # without a conclusive probe, a session that ran nothing counts as the host being down
+    _record_reachability(host, reachable if reachable is not None else bool(finished))
+
+def _host_check_interval():
+    return get_int_setting('host_check_interval', DEFAULT_HOST_CHECK_INTERVAL, MIN_CHECK_INTERVAL)
+
+def _probe_host(host, port, timeout):
+    # True if the port accepts connections, None if the name doesn't resolve here (it may be an
+    # alias only ssh knows), False otherwise
+    try:
+        with socket.create_connection((host, port), timeout):
+            return True
+    except socket.gaierror:
+        return None
+    except OSError as e:
+        logging.warning(f"{host}: port {port} unreachable: {e}")
+        return False
+
+def _host_backoff(host):
+    row = db.connect().execute("SELECT COALESCE(failures, 0), retry_at FROM hosts WHERE host = ?", (host,)).fetchone()
+    return row if row else (0, None)
+
+def _record_reachability(host, reachable):
+    # resets the host's backoff once it answers, otherwise doubles it
+    now = time.time()
+    con = db.connect()
+    if reachable:
+        with con:
+            con.execute("UPDATE hosts SET failures = 0, retry_at = NULL, last_seen = ? WHERE host = ?", (now, host))
+        return
+    failures = _host_backoff(host)[0] + 1
+    delay = min(get_int_setting('host_backoff_max', DEFAULT_HOST_BACKOFF_MAX), _host_check_interval() * 2 ** min(failures - 1, 20))
+    with con:
+        con.execute("UPDATE hosts SET failures = ?, retry_at = ? WHERE host = ?", (failures, now + delay, host))
+    logging.info(f"{host}: unreachable {failures} times, next try in {delay // 60} min")
+
+def _checksum_recheck_period():
+    return get_int_setting('checksum_recheck_days', DEFAULT_CHECKSUM_RECHECK_DAYS) * 86400
+
+def _next_checksum_due(prev_due, now, period):
+    # due time of the next full verification; manifests that aren't ok are re-checked every cycle regardless
+    if prev_due is not None and prev_due > now:
+        # first verification of a new manifest: keep the staggered due time it was discovered with
+        return prev_due
+    return now + period
+
+def reconcile_remote_checksum_files(host, listing) -> tuple[int, int]:
+    # Diffs the manifests found on a host against checksum_files in SQL. New paths are
+    # added as pending, vanished ones marked missing. Returns (added, removed) counts.
+    con = db.connect()
+    with con:
+        con.execute("CREATE TEMP TABLE IF NOT EXISTS found_checksum_files (path TEXT PRIMARY KEY)")
+        con.execute("DELETE FROM found_checksum_files")
+        con.executemany("INSERT OR IGNORE INTO found_checksum_files (path) VALUES (?)",
+                        ((p,) for p in map(str.strip, listing) if p))
+        # new manifests get a random due time within the recheck period, so a bulk of them
+        # discovered together doesn't come due together every week
+        added = con.execute("INSERT OR IGNORE INTO checksum_files (path, last_check, status, host, next_due) "
+                            "SELECT path, 0, 'pending', ?, ? + abs(random() % ?) FROM found_checksum_files",
+                            (host, time.time(), _checksum_recheck_period())).rowcount
+        removed = con.execute("UPDATE checksum_files SET status = 'missing' WHERE host = ? AND status != 'missing' "
+                              "AND path NOT IN (SELECT path FROM found_checksum_files)", (host,)).rowcount
+        con.execute("DELETE FROM found_checksum_files")
+    return added, removed
 
 def agestr(delta) -> str:
     total_seconds = int(delta.total_seconds())
@@ -117,74 +239,117 @@ def agestr(delta) -> str:
     if seconds or not parts: parts.append(f"{seconds}s")
     return "".join(parts)
 
-def check_task_execution():
+# (mtime_ns, size, status) of each task status file when it was last evaluated; files that still
+# match are not read again
+_task_index = {}
+# file name -> (failed attempts, earliest retry time) of status files that couldn't be read
+_task_retries = {}
+TASK_READ_ATTEMPTS = 10
+TASK_RETRY_DELAY = 3
+
+def check_task_execution(changed=None):
+    # Evaluates the task status files. changed is the set of file names a directory watcher reported
+    # since the last run; only those are read, and the other tasks' staleness is computed from the db.
+    # None looks at all files, but still only reads those that changed since they were last evaluated.
+    # Returns when the next task goes stale or a locked file is retried, so the check runs again then.
     default_timeout = 12
     try:
-        con = sqlite3.connect(str(common.DB_PATH))
+        con = db.connect()
         cur = con.cursor()
-        cur.execute("SELECT filename, timeout_hours FROM task_status")
-        db_tasks = {row[0]: row[1] for row in cur.fetchall()}
+        cur.execute("SELECT filename, timeout_hours, status FROM task_status")
+        db_tasks = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
         
-        found_files = set()
+        if changed is None:
+            names = {status_file.name for status_file in common.LOG_DIR_PATH.glob("*.status")} | db_tasks.keys()
+        else:
+            names = set(changed)
+        now_ts = time.time()
+        # files that were locked are retried here instead of blocking the check with sleeps
+        names |= {filename for filename, (_, retry_at) in _task_retries.items() if retry_at <= now_ts}
+        # all changes of this run are written in one transaction at the end
+        new_tasks = []
+        run_updates = []
+        status_updates = []
+        now = datetime.datetime.now()
+        read = 0
 
-        for status_file in common.LOG_DIR_PATH.glob("*.status"):
-            filename = status_file.name
-            found_files.add(filename)
+        for filename in sorted(names):
+            status_file = common.LOG_DIR_PATH / filename
+            try:
+                st = status_file.stat()
+            except FileNotFoundError:
+                _task_index.pop(filename, None)
+                _task_retries.pop(filename, None)
+                if filename in db_tasks:
+                    logging.warning(f"task {filename} status file missing")
+                    status_updates.append(('missing', filename))
+                continue
+            except OSError as ex:
+                logging.error(f"Error checking {filename}: {ex}")
+                status_updates.append((f"error: {str(ex)}", filename))
+                continue
             
-            timeout = db_tasks.get(filename)
+            timeout, db_status = db_tasks.get(filename, (None, None))
             if timeout is None:
                 timeout = default_timeout
-                with con:
-                    con.execute("INSERT INTO task_status (filename, timeout_hours, last_run, status) VALUES (?, ?, ?, ?)", (filename, timeout, 0, 'new'))
-                db_tasks[filename] = timeout
+                new_tasks.append((filename, timeout, 0, 'new'))
+                db_tasks[filename] = (timeout, 'new')
 
-            current_status = 'ok'
-            try:
-                mtime = datetime.datetime.fromtimestamp(status_file.stat().st_mtime)
-                now = datetime.datetime.now()
-                if (now - mtime).total_seconds() > timeout * 3600:
+            mtime = datetime.datetime.fromtimestamp(st.st_mtime)
+            if (now - mtime).total_seconds() > timeout * 3600:
+                if db_status != 'stale':
                     logging.warning(f"task {filename} stale: last run (updated {agestr(now - mtime)} ago)")
-                    with con:
-                        con.execute("UPDATE task_status SET last_run = ?, status = 'stale' WHERE filename = ?", (mtime.timestamp(), filename))
-                    continue
-
-                for i in range(10):
-                    try:
-                        content = status_file.read_text(encoding='utf-8').strip()
-                        break
-                    except Exception:
-                        if i == 9: raise
-                        time.sleep(3)
+                    run_updates.append((mtime.timestamp(), 'stale', filename))
+                _task_index[filename] = (st.st_mtime_ns, st.st_size, 'stale')
+                _task_retries.pop(filename, None)
+                continue
+            if _task_index.get(filename) == (st.st_mtime_ns, st.st_size, db_status):
+                continue
 
-                if not content.startswith("0:"):
-                    logging.warning(f"task {filename} failed: '{content}' (updated {agestr(now - mtime)} ago)")
-                    current_status = 'failed'
-                else:
-                    logging.info(f"task {filename} successful: '{content}' (updated {agestr(now - mtime)} ago)")
-                    current_status = 'ok'
-                
-                with con:
-                    con.execute("UPDATE task_status SET last_run = ?, status = ? WHERE filename = ?", (mtime.timestamp(), current_status, filename))
+            try:
+                content = status_file.read_text(encoding='utf-8').strip()
             except Exception as ex:
-                logging.error(f"Error checking {filename}: {ex}")
-                with con:
-                    con.execute("UPDATE task_status SET status = ? WHERE filename = ?", (f"error: {str(ex)}", filename))
+                attempts = _task_retries.get(filename, (0, 0))[0] + 1
+                if attempts < TASK_READ_ATTEMPTS:
+                    _task_retries[filename] = (attempts, now_ts + TASK_RETRY_DELAY)
+                else:
+                    del _task_retries[filename]
+                    logging.error(f"Error checking {filename}: {ex}")
+                    status_updates.append((f"error: {str(ex)}", filename))
+                continue
+            _task_retries.pop(filename, None)
+            read += 1
 
-        for filename in db_tasks:
-            if filename not in found_files:
-                logging.warning(f"task {filename} status file missing")
-                with con:
-                    con.execute("UPDATE task_status SET status = 'missing' WHERE filename = ?", (filename,))
+            if not content.startswith("0:"):
+                logging.warning(f"task {filename} failed: '{content}' (updated {agestr(now - mtime)} ago)")
+                current_status = 'failed'
+            else:
+                logging.info(f"task {filename} successful: '{content}' (updated {agestr(now - mtime)} ago)")
+                current_status = 'ok'
+            run_updates.append((mtime.timestamp(), current_status, filename))
+            _task_index[filename] = (st.st_mtime_ns, st.st_size, current_status)
+
+        # tasks whose files weren't looked at go stale once their last run is older than their timeout
+        for filename, last_run in cur.execute("SELECT filename, last_run FROM task_status WHERE status IN ('ok', 'failed') AND last_run + timeout_hours * 3600 < ?",
+                                              (now.timestamp(),)).fetchall():
+            if filename not in names:
+                logging.warning(f"task {filename} stale: last run (updated {agestr(now - datetime.datetime.fromtimestamp(last_run))} ago)")
+                status_updates.append(('stale', filename))
+
+        with con:
+            con.executemany("INSERT INTO task_status (filename, timeout_hours, last_run, status) VALUES (?, ?, ?, ?)", new_tasks)
+            con.executemany("UPDATE task_status SET last_run = ?, status = ? WHERE filename = ?", run_updates)
+            con.executemany("UPDATE task_status SET status = ? WHERE filename = ?", status_updates)
+        logging.debug(f"Task check: {len(names)} status files looked at, {read} read, {len(run_updates) + len(status_updates)} updates")
         
-        cur.execute("SELECT filename, status FROM task_status WHERE status != 'ok'")
-        rows = cur.fetchall()
-        if rows:
-            msg = f"Task {rows[0][0]}: {rows[0][1]}"
-            if len(rows) > 1:
-                msg += f" ({len(rows) - 1} more...)"
-            common.show_warning(msg)
-
-        con.close()
+        notifications.report('tasks', {filename: (status, f"Task {filename}: {status}")
+                                       for filename, status in cur.execute("SELECT filename, status FROM task_status WHERE status != 'ok'")})
+
+        wake_ups = [retry_at for _, retry_at in _task_retries.values()]
+        deadline = cur.execute("SELECT MIN(last_run + timeout_hours * 3600) FROM task_status WHERE status IN ('ok', 'failed')").fetchone()[0]
+        if deadline is not None:
+            wake_ups.append(deadline + 1)
+        return min(wake_ups) if wake_ups else None
     except Exception as ex:
         logging.exception("check_task_execution failed")
 
@@ -199,53 +364,191 @@ def get_fixed_drives():
         bitmask >>= 1
     return drives
 
-def verify_file_checksum(checksum_file):
-    base_dir = os.path.dirname(checksum_file)
-    try:
-        with open(checksum_file, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()
-    except Exception as e:
-        logging.error(f"Failed to read checksum file {checksum_file}: {e}")
-        return False
+def verify_file_checksum(checksum_file, engine=None):
+    engine = engine or HashEngine()
+    return engine.verify_manifests([checksum_file])[checksum_file]
 
-    all_ok = True
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('#'): continue
-        
-        parts = line.split(None, 1)
-        if len(parts) != 2:
-            continue
-        
-        expected_hash = parts[0].lower()
-        filename = parts[1].lstrip('*')
-        
-        target_path = os.path.join(base_dir, filename)
-        if not os.path.exists(target_path):
-            logging.error(f"File missing for checksum: {target_path}")
-            all_ok = False
-            continue
-            
+def _parse_sha256sum_line(line):
+    # (digest, filename) of a sha256sum output line; names with a backslash or newline are escaped
+    # and the line then starts with a backslash
+    escaped = line.startswith('\\')
+    if escaped:
+        line = line[1:]
+    if len(line) < 67 or line[64] != ' ':
+        return None, None
+    name = line[66:]
+    if escaped:
+        name = re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), name)
+    return line[:64].lower(), name
+
+
+# A due remote manifest, verified as part of its host's batch: the manifest is read, then sha256sum
+# runs on all of the device's cores for the files the current sweep hasn't verified yet, and each
+# result is recorded as it arrives. A sweep cut off by the session timeout only loses the files in
+# flight and continues with the rest next cycle; its start is kept in checksum_files.sweep_started.
+# A retry sweep of a failing manifest that isn't due yet only hashes the files whose entries failed.
+# The manifest's entries are stored as they arrive in a temporary table of the thread's connection,
+# which spills to a temp file, so a manifest listing millions of files isn't held in memory.
+class RemoteSweep:
+    def __init__(self, host, path, retry=False):
+        self.host = host
+        self.path = path
+        self.retry = retry
+        # number of entries the manifest lists, None until it was read
+        self.listed = None
+        self.status = None
+        self.rows = []
+        self.entries = []
+        con = db.connect()
+        with con:
+            con.execute("CREATE TEMP TABLE IF NOT EXISTS remote_manifest_entries (host TEXT, manifest TEXT, file TEXT, expected TEXT, PRIMARY KEY (host, manifest, file))")
+            con.execute("DELETE FROM remote_manifest_entries WHERE host = ? AND manifest = ?", (host, path))
+        if retry:
+            self.sweep_started = None
+            self.done = set()
+            self.failed = {row[0] for row in con.execute("SELECT file FROM checksum_entries WHERE host = ? AND manifest = ? AND status != 'ok'", (host, path))}
+        else:
+            # a new sweep starts once the manifest was read
+            self.sweep_started = con.execute("SELECT sweep_started FROM checksum_files WHERE path = ? AND host = ?", (path, host)).fetchone()[0]
+            self.done = self._verified_files() if self.sweep_started is not None else set()
+
+    def _verified_files(self):
+        return {row[0] for row in db.connect().execute("SELECT file FROM checksum_entries WHERE host = ? AND manifest = ? AND last_verified >= ?",
+                                                       (self.host, self.path, self.sweep_started))}
+
+    def add_to(self, batch, name):
+        # adds the commands that read the manifest and hash its remaining files to batch
+        parent, manifest = Path(self.path).parent.as_posix(), Path(self.path).name
+        batch.add(f"{name}_read", f'[ -e "{self.path}" ] || exit {REMOTE_MISSING_EXIT}; cat "{self.path}"', on_line=self.on_manifest_line)
+        hash_each = (f'xargs -0 -n 1 -P "$(nproc 2>/dev/null || echo 2)" '
+                     f'sh -c \'if [ -e "$1" ]; then sha256sum -- "$1" || echo "ERROR $1"; else echo "MISSING $1"; fi\' _')
+        if self.retry:
+            # the failed files are listed in the here-document
+            failed_list = '\n'.join(sorted(self.failed))
+            verify = f'cd "{parent}" && tr \'\\n\' \'\\0\' <<\'DONE_{batch.token}\' | {hash_each}\n{failed_list}\nDONE_{batch.token}'
+        else:
+            # awk reads the files verified so far from the here-document (after a sentinel line, so the
+            # first input is never empty) and prints the manifest's other file names
+            done_list = '\n'.join([batch.token, *sorted(self.done)])
+            verify = (f'cd "{parent}" && awk \'FNR == NR {{ done[$0] = 1; next }} {{ sub(/\\r$/, "") }} /^[ \\t]*(#|$)/ {{ next }} '
+                      f'{{ n = $0; sub(/^[ \\t]*[^ \\t]+[ \\t]+/, "", n); sub(/^\\*/, "", n); sub(/[ \\t]+$/, "", n); if (n != "" && !(n in done)) print n }}\' '
+                      f'- "{manifest}" <<\'DONE_{batch.token}\' | tr \'\\n\' \'\\0\' | {hash_each}\n'
+                      f'{done_list}\nDONE_{batch.token}')
+        batch.add(f"{name}_verify", verify, on_line=self.on_line)
+
+    def on_manifest_line(self, line):
+        self.entries.extend((self.host, self.path, filename, digest) for digest, filename in parse_manifest_lines((line,)))
+        if len(self.entries) >= REMOTE_MANIFEST_BATCH:
+            self._store_entries()
+
+    def _store_entries(self):
+        con = db.connect()
+        with con:
+            # a file listed twice keeps its last digest
+            con.executemany("INSERT OR REPLACE INTO remote_manifest_entries (host, manifest, file, expected) VALUES (?, ?, ?, ?)", self.entries)
+        self.entries.clear()
+
+    def _expected(self, filename):
+        row = db.connect().execute("SELECT expected FROM remote_manifest_entries WHERE host = ? AND manifest = ? AND file = ?",
+                                   (self.host, self.path, filename)).fetchone()
+        return row[0] if row else None
+
+    def manifest_read(self, code, output):
+        self._store_entries()
+        if code != 0:
+            self.status = 'missing' if code == REMOTE_MISSING_EXIT else 'error'
+            logging.error(f"Failed to read remote checksum file {self.path} on {self.host} (exit code {code})")
+            return
+        con = db.connect()
+        self.listed = con.execute("SELECT COUNT(*) FROM remote_manifest_entries WHERE host = ? AND manifest = ?", (self.host, self.path)).fetchone()[0]
+        if self.retry:
+            logging.info(f"Re-verifying {len(self.failed)} failed entries of remote checksum file {self.path} on {self.host}...")
+            return
+        if self.sweep_started is None:
+            self.sweep_started = time.time()
+            with con:
+                con.execute("UPDATE checksum_files SET sweep_started = ? WHERE path = ? AND host = ?", (self.sweep_started, self.path, self.host))
+        logging.info(f"Verifying remote checksums in {self.path} on {self.host}: {self.listed - len(self.done)} of {self.listed} files left...")
+
+    def on_line(self, line):
+        if self.listed is None:
+            return
+        if line.startswith(('MISSING ', 'ERROR ')):
+            word, _, filename = line.partition(' ')
+            status, digest = word.lower(), None
+        else:
+            digest, filename = _parse_sha256sum_line(line)
+            if filename is None:
+                return
+            status = None
+        expected = self._expected(filename)
+        if expected is None:
+            return
+        if status is None:
+            status = 'ok' if digest == expected else 'mismatch'
+        if status != 'ok':
+            logging.error(f"Remote checksum {status} for {filename} in {self.path} on {self.host}")
+        self.rows.append((self.host, self.path, filename, expected, time.time(), status))
+        if len(self.rows) >= REMOTE_RESULT_BATCH:
+            self.flush()
+
+    def flush(self):
+        con = db.connect()
+        with con:
+            con.executemany("INSERT OR REPLACE INTO checksum_entries (host, manifest, file, expected, last_verified, status) VALUES (?, ?, ?, ?, ?, ?)", self.rows)
+        self.rows.clear()
+
+    def finish(self):
+        # records the outcome; returns the manifest status, or None if the sweep continues next cycle
+        con = db.connect()
         try:
-            sha256 = hashlib.sha256()
-            with open(target_path, 'rb') as tf:
-                while chunk := tf.read(8192 * 1024):
-                    sha256.update(chunk)
-            calculated_hash = sha256.hexdigest().lower()
-            
-            if calculated_hash != expected_hash:
-                logging.error(f"Checksum mismatch for {target_path}")
-                all_ok = False
-        except Exception as e:
-            logging.error(f"Error verifying {target_path}: {e}")
-            all_ok = False
-            
-    return all_ok
+            return self._record_outcome(con)
+        finally:
+            with con:
+                con.execute("DELETE FROM remote_manifest_entries WHERE host = ? AND manifest = ?", (self.host, self.path))
+
+    def _record_outcome(self, con):
+        self.flush()
+        if self.status is None:
+            if self.listed is None:
+                return None
+            if self.retry:
+                with con:
+                    # drop failed entries that are no longer listed in the manifest
+                    con.executemany("DELETE FROM checksum_entries WHERE host = ? AND manifest = ? AND file = ?",
+                                    [(self.host, self.path, filename) for filename in self.failed if self._expected(filename) is None])
+            else:
+                left = con.execute("SELECT COUNT(*) FROM remote_manifest_entries m WHERE host = ? AND manifest = ? AND NOT EXISTS "
+                                   "(SELECT 1 FROM checksum_entries e WHERE e.host = m.host AND e.manifest = m.manifest AND e.file = m.file AND e.last_verified >= ?)",
+                                   (self.host, self.path, self.sweep_started)).fetchone()[0]
+                if left:
+                    logging.info(f"Remote checksums in {self.path} on {self.host}: {left} files left, continuing next cycle")
+                    return None
+                with con:
+                    # drop entries that are no longer listed in the manifest and end the sweep
+                    con.execute("DELETE FROM checksum_entries WHERE host = ? AND manifest = ? AND last_verified < ?", (self.host, self.path, self.sweep_started))
+                    con.execute("UPDATE checksum_files SET sweep_started = NULL WHERE path = ? AND host = ?", (self.path, self.host))
+            failed = con.execute("SELECT COUNT(*) FROM checksum_entries WHERE host = ? AND manifest = ? AND status != 'ok'", (self.host, self.path)).fetchone()[0]
+            if failed:
+                logging.warning(f"Remote checksum failed: {self.path} ({failed} files)")
+                self.status = 'failed'
+            else:
+                logging.info(f"Remote checksum passed: {self.path}")
+                self.status = 'ok'
+        now = time.time()
+        with con:
+            next_due = con.execute("SELECT next_due FROM checksum_files WHERE path = ? AND host = ?", (self.path, self.host)).fetchone()[0]
+            con.execute("UPDATE checksum_files SET last_check = ?, status = ?, next_due = ? WHERE path = ? AND host = ?",
+                        (now, self.status, _next_checksum_due(next_due, now, _checksum_recheck_period()), self.path, self.host))
+        return self.status
 
 def check_checksums():
     try:
-        con = sqlite3.connect(str(common.DB_PATH))
+        con = db.connect()
         cur = con.cursor()
+        now = time.time()
+        period = _checksum_recheck_period()
+        budget = get_int_setting('checksum_budget_gb', DEFAULT_CHECKSUM_BUDGET_GB) * 1024**3
         
         drives = get_fixed_drives()
 
@@ -255,99 +558,287 @@ def check_checksums():
                 patterns = [os.path.join(drive, "*_sha256"), os.path.join(drive, "*.sha256")]
                 for pattern in patterns:
                     for filepath in glob.glob(pattern):
-                        con.execute("INSERT OR IGNORE INTO checksum_files (path, last_check, status, host) VALUES (?, 0, 'pending', '')", (filepath,))
+                        con.execute("INSERT OR IGNORE INTO checksum_files (path, last_check, status, host, next_due) VALUES (?, 0, 'pending', '', ? + abs(random() % ?))",
+                                    (filepath, now, period))
 
-        cur.execute("SELECT path, last_check, status, host FROM checksum_files")
-        all_files = cur.fetchall()
+        # remote manifests are verified by their host's check, in the same ssh session as its metrics
+        cur.execute("SELECT path, status, next_due, size_bytes, manifest_mtime_ns FROM checksum_files WHERE host = '' AND (status != 'ok' OR COALESCE(next_due, 0) <= ?) ORDER BY COALESCE(next_due, 0)", (now,))
+        due_files = cur.fetchall()
         
-        ssh_key = get_ssh_key_path()
+        local_due = {}
+        local_retry = []
+        # manifests due for a full verification, most overdue first, with their last known size
+        candidates = []
+        # status updates of this phase, committed together once the slow verification work is done
+        updates = []
+        retry_updates = []
+        # sizes of manifests measured for the first time, kept so deferred ones aren't measured every cycle
+        measured = []
 
-        for row in all_files:
-            path, last_check, status, host = row
-            
-            needs_check = False
-            if status != 'ok':
-                needs_check = True
-            else:
-                try:
-                    if time.time() - float(last_check) > 7 * 86400:
-                        needs_check = True
-                except (ValueError, TypeError):
-                    needs_check = True
-            
-            if not needs_check:
-                continue
+        for row in due_files:
+            common.check_cancelled()
+            path, status, next_due, size_bytes, manifest_mtime_ns = row
 
-            new_status = 'failed'
-            
-            if not host:
-                if not os.path.exists(path):
-                    new_status = 'missing'
-                else:
-                    logging.info(f"Verifying local checksums in {path}...")
-                    if verify_file_checksum(path):
-                        new_status = 'ok'
-                    else:
-                        new_status = 'failed'
+            if not os.path.exists(path):
+                updates.append((time.time(), 'missing', _next_checksum_due(next_due, time.time(), period), size_bytes, None, path, ''))
+            elif (status == 'failed' and (next_due or 0) > now and os.stat(path).st_mtime_ns == manifest_mtime_ns
+                  and cur.execute("SELECT 1 FROM checksum_entries WHERE host = '' AND manifest = ? AND status != 'ok' LIMIT 1", (path,)).fetchone()):
+                # a failing manifest that isn't due for a full pass: only re-verify its failed entries
+                local_retry.append(path)
             else:
-                logging.info(f"Verifying remote checksums in {path} on {host}...")
+                if size_bytes is None:
+                    try:
+                        size_bytes = manifest_size(path)
+                        measured.append((size_bytes, path))
+                    except Exception:
+                        size_bytes = 0
+                candidates.append((path, next_due, size_bytes))
 
-                remote_cmd = f'cd "{Path(path).parent.as_posix()}" && sha256sum -c "{Path(path).name}"'
-                cmd = _get_ssh_cmd(host, key_file=ssh_key, remote_cmd=remote_cmd)
-                
-                try:
-                    startupinfo = None
-                    if sys.platform == 'win32':
-                        startupinfo = subprocess.STARTUPINFO()
-                        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                    
-                    res = subprocess.run(cmd, capture_output=True, text=True, startupinfo=startupinfo, timeout=300)
-                    
-                    if res.returncode == 0:
-                        new_status = 'ok'
-                        logging.info(f"Remote checksum passed: {path}")
-                    else:
-                        new_status = 'failed'
-                        logging.warning(f"Remote checksum failed: {path}\n{res.stderr}")
-                except Exception as e:
-                    logging.error(f"Remote verification error for {path}: {e}")
-                    new_status = 'error'
+        if measured:
+            with con:
+                con.executemany("UPDATE checksum_files SET size_bytes = ? WHERE path = ? AND host = ''", measured)
+
+        if candidates or local_retry:
+            cache = HashCache(common.DB_PATH, get_int_setting('hash_cache_max_age_days', DEFAULT_CACHE_MAX_AGE_DAYS))
+            checkpoints = HashCheckpoints(common.DB_PATH, get_int_setting('resumable_hash_min_mb', DEFAULT_RESUMABLE_MIN_MB))
+            throttle = Throttle(get_int_setting('hash_rate_limit_mb', DEFAULT_RATE_LIMIT_MB), get_int_setting('hash_pause_load_pct', DEFAULT_PAUSE_LOAD_PCT))
+            low_priority = get_int_setting('hash_low_priority', DEFAULT_LOW_PRIORITY) != 0
+            engine = HashEngine(get_int_setting('hash_max_devices', DEFAULT_MAX_DEVICES), cache, checkpoints, throttle, low_priority)
+            # failures are confirmed by reading the files again, never from the hash cache
+            retry_engine = HashEngine(engine.max_devices, None, checkpoints, throttle, low_priority)
 
+            def record_entries(rows):
+                # Files that passed get the fingerprint later quick checks compare against. Files
+                # that weren't re-read (hash cache hits) come without a sample and keep the stored
+                # one as long as their size and mtime are unchanged. Failed files never replace the
+                # sample, it would make the damaged content the reference of later quick checks.
+                verified = time.time()
+                with con:
+                    con.executemany("INSERT INTO checksum_entries (host, manifest, file, expected, last_verified, status, size, mtime_ns, sample, sampled_at) VALUES ('', ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                                    "ON CONFLICT (host, manifest, file) DO UPDATE SET expected = excluded.expected, last_verified = excluded.last_verified, status = excluded.status, "
+                                    "sample = CASE WHEN excluded.status != 'ok' THEN sample "
+                                    "WHEN excluded.sample IS NOT NULL THEN excluded.sample "
+                                    "WHEN status = 'ok' AND expected = excluded.expected AND size = excluded.size AND mtime_ns = excluded.mtime_ns THEN sample END, "
+                                    "sampled_at = CASE WHEN excluded.status = 'ok' AND excluded.sample IS NOT NULL THEN excluded.sampled_at ELSE sampled_at END, "
+                                    "size = excluded.size, mtime_ns = excluded.mtime_ns",
+                                    [(manifest, filename, expected, verified, status, size, mtime_ns, sample, verified if status == 'ok' and sample else None)
+                                     for manifest, filename, expected, status, size, mtime_ns, sample in rows])
+                _forget_digests(os.path.join(os.path.dirname(manifest), filename) for manifest, filename, _, status, *_ in rows if status == 'mismatch')
+
+        # Manifests are verified in rounds, each one batch so manifests on different drives are
+        # hashed in parallel. A round takes manifests, most overdue first, while their full size
+        # fits in what's left of the cycle's byte budget; the budget is then only charged the
+        # bytes actually read, so manifests mostly verified from the hash cache leave room for more
+        # rounds. At least one manifest is always verified so huge manifests make progress too.
+        spent = 0
+        candidates.reverse()
+        while candidates:
+            batch = {}
+            planned = spent
+            while candidates and (not (local_due or batch) or planned + candidates[-1][2] <= budget):
+                path, next_due, size_bytes = candidates.pop()
+                batch[path] = next_due
+                planned += size_bytes
+            if not batch:
+                break
+            read_before = engine.read_bytes
+            logging.info(f"Verifying local checksums in {len(batch)} files ({(planned - spent) / 1024**3:.1f} GB listed)...")
+            sweep_start = time.time()
+            mtimes = {}
+            for path in batch:
+                try:
+                    mtimes[path] = os.stat(path).st_mtime_ns
+                except OSError:
+                    mtimes[path] = None
+            # files that failed before are read again, a cached digest may predate the damage
+            engine.uncached = {os.path.join(os.path.dirname(path), filename) for path in batch for filename, in
+                               con.execute("SELECT file FROM checksum_entries WHERE host = '' AND manifest = ? AND status != 'ok'", (path,))}
+            results = engine.verify_manifests(list(batch), on_results=record_entries)
             with con:
-                con.execute("UPDATE checksum_files SET last_check = ?, status = ? WHERE path = ? AND host = ?", (time.time(), new_status, path, host))
+                # drop entries that are no longer listed in their manifest
+                con.executemany("DELETE FROM checksum_entries WHERE host = '' AND manifest = ? AND last_verified < ?",
+                                [(path, sweep_start) for path in batch])
+            for path, next_due in batch.items():
+                new_status = 'ok' if results[path] else 'failed'
+                logging.info(f"Local checksum {new_status}: {path}")
+                updates.append((time.time(), new_status, _next_checksum_due(next_due, time.time(), period), engine.manifest_bytes.get(path), mtimes[path], path, ''))
 
-        cur.execute("SELECT path, status, host FROM checksum_files WHERE status != 'ok'")
-        for row in cur.fetchall():
-            p, s, h = row
-            prefix = f"Remote ({h})" if h else "Local"
-            common.show_warning(f"Checksum validation failed [{prefix}]: {p} ({s})")
+            spent += engine.read_bytes - read_before
+            local_due.update(batch)
+        if local_due:
+            logging.info(f"Read {spent / 1024**3:.1f} GB to verify {len(local_due)} local checksum files, {len(candidates)} deferred to later cycles")
+
+        if local_retry:
+            logging.info(f"Re-verifying failed entries of {len(local_retry)} local checksum files...")
+            failed_entries = (row for path in local_retry for row in
+                              con.execute("SELECT manifest, file, expected FROM checksum_entries WHERE host = '' AND manifest = ? AND status != 'ok'", (path,)).fetchall())
+            results = retry_engine.verify_entries(failed_entries, on_results=record_entries)
+            for path in local_retry:
+                remaining = con.execute("SELECT COUNT(*) FROM checksum_entries WHERE host = '' AND manifest = ? AND status != 'ok'", (path,)).fetchone()[0]
+                new_status = 'ok' if remaining == 0 else 'failed'
+                logging.info(f"Local checksum {new_status}: {path} ({remaining} failed entries)")
+                retry_updates.append((time.time(), new_status, path))
+
+        if local_due or local_retry:
+            if cache.hits:
+                logging.info(f"Hash cache: {cache.hits} unchanged files ({cache.hit_bytes / 1024**2:.0f} MB) not re-read")
+            dedup_files = engine.dedup_files + retry_engine.dedup_files
+            dedup_bytes = engine.dedup_bytes + retry_engine.dedup_bytes
+            if dedup_files:
+                logging.info(f"Hashed shared files once: {dedup_files} duplicate references ({dedup_bytes / 1024**2:.0f} MB) not re-read")
+            if throttle.paused:
+                logging.info(f"Hashing paused for {throttle.paused:.0f}s while the system was busy")
+
+        with con:
+            con.executemany("UPDATE checksum_files SET last_check = ?, status = ?, next_due = ?, size_bytes = ?, manifest_mtime_ns = ? WHERE path = ? AND host = ?", updates)
+            con.executemany("UPDATE checksum_files SET last_check = ?, status = ? WHERE path = ? AND host = ''", retry_updates)
+
+        quick_check_manifests(exclude=local_due, budget=max(0, budget - spent))
 
-        con.close()
+        problems = {}
+        # pending manifests haven't been verified yet, so they aren't problems
+        for p, s, h in cur.execute("SELECT path, status, host FROM checksum_files WHERE status NOT IN ('ok', 'pending')"):
+            prefix = f"Remote ({h})" if h else "Local"
+            problems[f"{h}:{p}"] = (s, f"Checksum validation failed [{prefix}]: {p} ({s})")
+        notifications.report('checksums', problems)
     except Exception as ex:
         logging.exception("check_checksums failed")
 
+def _forget_digests(paths):
+    # a file that failed verification is read in full by the next pass: its cached digest and any
+    # checkpoint may be of the content before the damage, as a restored mtime hides the change
+    paths = list(paths)
+    if not paths:
+        return
+    HashCache(common.DB_PATH).discard(paths)
+    checkpoints = HashCheckpoints(common.DB_PATH)
+    for path in paths:
+        checkpoints.delete(path)
+
+def quick_check_manifests(exclude=(), budget=None):
+    # Cheap tier that runs every cycle between full verifications: compares the files of all passing
+    # local manifests against the size and mtime recorded at their last full pass. A share of the
+    # files, so that each comes up about once per QUICK_SAMPLE_PERIOD, also has its sampled blocks
+    # compared, as long as the cycle's byte budget lasts. Files verified from the hash cache get
+    # their first sample that way. Failed entries are fully re-hashed by the next check_checksums cycle.
+    con = db.connect()
+    manifests = [row for row in con.execute("SELECT path, manifest_mtime_ns FROM checksum_files WHERE host = '' AND status = 'ok'").fetchall()
+                 if row[0] not in exclude]
+    if not manifests:
+        return
+    start = time.monotonic()
+    checked = 0
+    failed = 0
+    for path, manifest_mtime_ns in manifests:
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            with con:
+                con.execute("UPDATE checksum_files SET last_check = ?, status = 'missing' WHERE path = ? AND host = ''", (time.time(), path))
+            continue
+        except OSError:
+            continue
+        if mtime_ns != manifest_mtime_ns:
+            logging.info(f"Checksum file changed, scheduling full verification: {path}")
+            with con:
+                con.execute("UPDATE checksum_files SET next_due = ? WHERE path = ? AND host = ''", (time.time(), path))
+            continue
+
+        base_dir = os.path.dirname(path)
+        entry_updates = []
+        for filename, size, entry_mtime_ns in con.execute("SELECT file, size, mtime_ns FROM checksum_entries WHERE host = '' AND manifest = ? AND status = 'ok' AND size IS NOT NULL",
+                                                          (path,)).fetchall():
+            common.check_cancelled()
+            checked += 1
+            status = quick_check(os.path.join(base_dir, filename), size, entry_mtime_ns)
+            if status != 'ok':
+                entry_updates.append((status, path, filename))
+        _record_quick_failures(entry_updates)
+        failed += len(entry_updates)
+
+    sampled, sample_failed = _sample_entries(exclude, budget)
+    logging.info(f"Quick-checked {checked} files of {len(manifests)} checksum files in {time.monotonic() - start:.1f}s, "
+                 f"{failed + sample_failed} failed, {sampled} sampled")
+
+def _record_quick_failures(entry_updates):
+    # entry_updates are (status, manifest, file) of entries that failed a quick check
+    if not entry_updates:
+        return
+    for status, manifest, filename in entry_updates:
+        logging.warning(f"Quick check {status}: {os.path.join(os.path.dirname(manifest), filename)}")
+    con = db.connect()
+    with con:
+        con.executemany("UPDATE checksum_entries SET status = ? WHERE host = '' AND manifest = ? AND file = ?", entry_updates)
+        con.executemany("UPDATE checksum_files SET last_check = ?, status = 'failed' WHERE path = ? AND host = ''",
+                        [(time.time(), manifest) for manifest in {manifest for _, manifest, _ in entry_updates}])
+    _forget_digests(os.path.join(os.path.dirname(manifest), filename) for status, manifest, filename in entry_updates if status in ('mismatch', 'changed'))
+
+def _sample_entries(exclude, budget):
+    # Reads the sampled blocks of the passing entries that were sampled longest ago, through the
+    # throttled low priority reader of full verifications. Returns (sampled, failed) counts.
+    con = db.connect()
+    total = con.execute("SELECT COUNT(*) FROM checksum_entries e JOIN checksum_files f ON f.host = e.host AND f.path = e.manifest "
+                        "WHERE e.host = '' AND f.status = 'ok' AND e.status = 'ok' AND e.size IS NOT NULL").fetchone()[0]
+    interval = get_int_setting('checksum_check_interval', DEFAULT_CHECKSUM_CHECK_INTERVAL, MIN_CHECK_INTERVAL)
+    count = -(-total * interval // QUICK_SAMPLE_PERIOD)
+    if budget is not None:
+        count = min(count, budget // (3 * QUICK_SAMPLE_SIZE))
+    if count <= 0:
+        return 0, 0
+    rows = [row for row in con.execute("SELECT e.manifest, e.file, e.size, e.mtime_ns, e.sample FROM checksum_entries e JOIN checksum_files f ON f.host = e.host AND f.path = e.manifest "
+                                       "WHERE e.host = '' AND f.status = 'ok' AND e.status = 'ok' AND e.size IS NOT NULL ORDER BY COALESCE(e.sampled_at, 0) LIMIT ?", (count,)).fetchall()
+            if row[0] not in exclude]
+    throttle = Throttle(get_int_setting('hash_rate_limit_mb', DEFAULT_RATE_LIMIT_MB), get_int_setting('hash_pause_load_pct', DEFAULT_PAUSE_LOAD_PCT))
+    low_priority = get_int_setting('hash_low_priority', DEFAULT_LOW_PRIORITY) != 0
+
+    def sample_all():
+        results = []
+        with throttle.hashing():
+            for manifest, filename, size, mtime_ns, sample in rows:
+                common.check_cancelled()
+                path = os.path.join(os.path.dirname(manifest), filename)
+                status = quick_check(path, size, mtime_ns, sample, throttle)
+                if status == 'ok' and sample is None:
+                    try:
+                        sample = sample_digest(path, size, throttle)
+                    except OSError:
+                        status = 'error'
+                results.append((status, sample, manifest, filename))
+        return results
+
+    with DaemonThreadPool(1, thread_name_prefix="QuickCheck", initializer=lower_thread_priority if low_priority else None) as executor:
+        results = executor.submit(sample_all).result()
+    now = time.time()
+    with con:
+        con.executemany("UPDATE checksum_entries SET sample = ?, sampled_at = ? WHERE host = '' AND manifest = ? AND file = ?",
+                        [(sample, now, manifest, filename) for status, sample, manifest, filename in results if status == 'ok'])
+    failures = [(status, manifest, filename) for status, _, manifest, filename in results if status != 'ok']
+    _record_quick_failures(failures)
+    return len(results), len(failures)
+
 def get_monitored_hosts():
     hosts = []
     try:
-        con = sqlite3.connect(str(common.DB_PATH))
-        cur = con.cursor()
+        cur = db.connect().cursor()
         cur.execute("SELECT host, battery_threshold, storage_threshold, port FROM hosts")
         hosts = cur.fetchall()
-        con.close()
     except Exception as e:
         logging.error(f"Failed to get hosts from DB: {e}")
     return hosts
 
-def get_ssh_key_path():
-    key_path = None
+def get_setting(key, default=None):
     try:
-        con = sqlite3.connect(str(common.DB_PATH))
-        cur = con.cursor()
-        cur.execute("SELECT value FROM settings WHERE key = 'ssh_key_path'")
-        row = cur.fetchone()
-        if row:
-            key_path = row[0]
-        con.close()
+        return db.get_setting(key, default)
     except Exception:
-        pass
-    return key_path
\ No newline at end of file
+        return default
+
+def get_int_setting(key, default, minimum=None):
+    try:
+        value = int(get_setting(key, default))
+    except (ValueError, TypeError):
+        logging.error(f"Invalid value for setting {key}, using {default}")
+        value = default
+    return value if minimum is None else max(minimum, value)
+
+def get_ssh_key_path():
+    return get_setting('ssh_key_path')
@@ -1,10 +1,9 @@
-import logging
 import os
-import subprocess
+import threading
 from pathlib import Path
 
 from PIL import Image, ImageDraw
-from windows_toasts import Toast, WindowsToaster
+from windows_toasts import WindowsToaster
 
 # Constants
 APPNAME = "host_checker"
@@ -20,26 +19,31 @@ LOCK_FILE_PATH = CFG_DIR_PATH / 'lock'
 DB_PATH = CFG_DIR_PATH / 'sqlite.db'
 
 # Global State
-warning_triggered = False
 open_log_callback = None
 toaster = WindowsToaster(APPNAME)
+# set on quit; checks poll it through check_cancelled() and stop as soon as they can
+shutdown_event = threading.Event()
+# tracks whether the check running on the current thread raised a warning
+_warning_scope = threading.local()
 
-def show_warning(message):
-    global warning_triggered
-    warning_triggered = True
-    try:
-        logging.warning(message)
-        new_toast = Toast()
-        new_toast.text_fields = [f"⚠️ {message}"]
-        def on_click(args):
-            if open_log_callback:
-                open_log_callback()
-            else:
-                subprocess.Popen(['notepad.exe', str(LOG_FILE_PATH)])
-        new_toast.on_activated = on_click
-        toaster.show_toast(new_toast)
-    except Exception as e:
-        logging.error(f"Failed to show toast: {e}")
+# Raised by check_cancelled(). Like asyncio.CancelledError it isn't an Exception, so the
+# handlers around the individual steps of a check don't swallow it.
+class Cancelled(BaseException):
+    pass
+
+def check_cancelled():
+    if shutdown_event.is_set():
+        raise Cancelled()
+
+def begin_warning_scope():
+    _warning_scope.triggered = False
+
+def warning_scope_triggered():
+    return getattr(_warning_scope, 'triggered', False)
+
+def mark_warning():
+    # the check running on the current thread found a problem; turns the tray icon red
+    _warning_scope.triggered = True
 
 def create_icon(status):
     width = 64
@@ -1,10 +1,10 @@
 import datetime
 import logging
 import os
-import sqlite3
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 
+from host_checker import db
 from ui.tools import Tools
 
 
@@ -39,7 +39,9 @@ class ConfigCksumsWindow:
         btn_frame.pack(fill=tk.X, pady=5)
         tk.Button(btn_frame, text="Add File", command=self.add_file).pack(side=tk.LEFT, padx=5)
         tk.Button(btn_frame, text="Remove Selected", command=self.remove_file).pack(side=tk.LEFT, padx=5)
+        tk.Button(btn_frame, text="Show Failed Files", command=self.show_failed).pack(side=tk.LEFT, padx=5)
         tk.Button(btn_frame, text="Refresh", command=self.load_data).pack(side=tk.LEFT, padx=5)
+        self.tree.bind("<Double-1>", lambda e: self.show_failed())
         
         self.load_data()
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
@@ -50,7 +52,7 @@ class ConfigCksumsWindow:
             self.tree.delete(i)
         
         try:
-            con = sqlite3.connect(str(self.db_path))
+            con = db.connect(self.db_path)
             cur = con.cursor()
             cur.execute("SELECT host, path, last_check, status FROM checksum_files ORDER BY host, path ASC")
             for row in cur.fetchall():
@@ -60,7 +62,6 @@ class ConfigCksumsWindow:
                 except:
                     dt = str(ts)
                 self.tree.insert('', tk.END, values=(row[0], row[1], dt, row[3]))
-            con.close()
         except Exception as e:
             logging.error(f"Failed to load DB: {e}")
             
@@ -69,10 +70,9 @@ class ConfigCksumsWindow:
         if path:
             path = os.path.normpath(path)
             try:
-                con = sqlite3.connect(str(self.db_path))
+                con = db.connect(self.db_path)
                 with con:
                     con.execute("INSERT OR IGNORE INTO checksum_files (path, last_check, status) VALUES (?, ?, ?)", (path, 0, 'pending'))
-                con.close()
                 self.load_data()
             except Exception as e:
                 messagebox.showerror("Error", str(e))
@@ -85,14 +85,49 @@ class ConfigCksumsWindow:
             host = values[0]
             path = values[1]
             try:
-                con = sqlite3.connect(str(self.db_path))
+                con = db.connect(self.db_path)
                 with con:
                     con.execute("DELETE FROM checksum_files WHERE path = ? AND host = ?", (path, host))
-                con.close()
+                    con.execute("DELETE FROM checksum_entries WHERE manifest = ? AND host = ?", (path, host))
             except Exception as e:
                 logging.error(f"Error deleting {path}: {e}")
         self.load_data()
 
+    def show_failed(self):
+        selected = self.tree.selection()
+        if not selected: return
+        host, path = self.tree.item(selected[0], 'values')[:2]
+        try:
+            con = db.connect(self.db_path)
+            rows = con.execute("SELECT file, status, last_verified FROM checksum_entries WHERE host = ? AND manifest = ? AND status != 'ok' ORDER BY file",
+                               (host, path)).fetchall()
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+            return
+
+        top = tk.Toplevel(self.root)
+        top.title(f"Failed Files: {path}")
+        frame = tk.Frame(top)
+        frame.pack(fill=tk.BOTH, expand=True)
+        columns = ('file', 'status', 'last_verified')
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL)
+        tree = ttk.Treeview(frame, columns=columns, show='headings', yscrollcommand=scrollbar.set)
+        scrollbar.config(command=tree.yview)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.heading('file', text='File')
+        tree.heading('status', text='Status')
+        tree.heading('last_verified', text='Last Verified')
+        tree.column('file', width=400, stretch=True)
+        tree.column('status', width=100, stretch=False)
+        tree.column('last_verified', width=150, stretch=False)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        for file, status, ts in rows:
+            dt = datetime.datetime.fromtimestamp(float(ts)).strftime('%Y-%m-%d %H:%M:%S') if ts else ''
+            tree.insert('', tk.END, values=(file, status, dt))
+        if not rows:
+            tree.insert('', tk.END, values=("(no failed entries recorded)", '', ''))
+        Tools.center_window(top, 700, 400)
+
     def on_close(self):
         self.root.destroy()
         
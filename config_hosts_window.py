@@ -1,17 +1,16 @@
-import concurrent.futures
-import ipaddress
 import logging
 import os
-import socket
 import sqlite3
 import subprocess
-import threading
+import time
 import tkinter as tk
-from tkinter import filedialog, messagebox, simpledialog, ttk
+from tkinter import filedialog, messagebox, ttk
 
 import host_checker.common as common
+import host_checker.db as db
 from host_checker.add_host_dialog import AddHostDialog
 from host_checker.battery_window import BatteryAnalysisWindow
+from host_checker.scan_dialog import ScanDialog
 from ui.tools import Tools
 
 
@@ -22,7 +21,7 @@ class ConfigHostsWindow:
         self.root.title(f"{common.APPNAME} {common.APP_VERSION} - Hosts Configuration")
         
         # Treeview
-        columns = ('host', 'port', 'battery', 'storage')
+        columns = ('host', 'port', 'battery', 'storage', 'reachable')
         tree_frame = tk.Frame(self.root)
         tree_frame.pack(fill=tk.BOTH, expand=True)
         
@@ -34,10 +33,12 @@ class ConfigHostsWindow:
         self.tree.heading('port', text='Port')
         self.tree.heading('battery', text='Battery %')
         self.tree.heading('storage', text='Storage MB')
+        self.tree.heading('reachable', text='Reachable')
         self.tree.column('host', width=250, stretch=True)
         self.tree.column('port', width=60, stretch=False)
         self.tree.column('battery', width=80, stretch=False)
         self.tree.column('storage', width=80, stretch=False)
+        self.tree.column('reachable', width=170, stretch=False)
         self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.tree.bind("<Double-1>", lambda e: self.edit_host())
         self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
@@ -64,7 +65,7 @@ class ConfigHostsWindow:
         tk.Button(settings_frame, text="Test", command=self.test_key).pack(side=tk.LEFT, padx=5)
 
         self.load_data()
-        Tools.center_window(self.root, 500, 400)
+        Tools.center_window(self.root, 670, 400)
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def on_tree_select(self, event):
@@ -78,17 +79,18 @@ class ConfigHostsWindow:
         if not selected: return
         values = self.tree.item(selected[0], 'values')
         host = values[0]
-        BatteryAnalysisWindow(self.root, host, common.LOG_FILE_PATH)
+        BatteryAnalysisWindow(self.root, host)
 
     def load_data(self):
         for i in self.tree.get_children():
             self.tree.delete(i)
         try:
-            con = sqlite3.connect(str(self.db_path))
+            con = db.connect(self.db_path)
             cur = con.cursor()
-            cur.execute("SELECT host, battery_threshold, storage_threshold, port FROM hosts ORDER BY host ASC")
+            cur.execute("SELECT host, battery_threshold, storage_threshold, port, failures, retry_at, last_seen FROM hosts ORDER BY host ASC")
             for row in cur.fetchall():
-                self.tree.insert('', tk.END, values=(row[0], row[3] if row[3] is not None else 8022, row[1] if row[1] is not None else 15, row[2] if row[2] is not None else 1024))
+                self.tree.insert('', tk.END, values=(row[0], row[3] if row[3] is not None else 8022, row[1] if row[1] is not None else 15, row[2] if row[2] is not None else 1024,
+                                                     self.reachability(row[4], row[5], row[6])))
             
             try:
                 cur.execute("SELECT value FROM settings WHERE key = 'ssh_key_path'")
@@ -96,10 +98,17 @@ class ConfigHostsWindow:
                 if row: self.key_var.set(row[0])
             except sqlite3.OperationalError:
                 pass
-            con.close()
         except Exception as e:
             logging.error(f"Failed to load hosts DB: {e}")
 
+    @staticmethod
+    def reachability(failures, retry_at, last_seen) -> str:
+        if failures and retry_at:
+            return f"No ({failures}x), retry {time.strftime('%d.%m. %H:%M', time.localtime(retry_at))}"
+        if last_seen:
+            return f"Yes, {time.strftime('%d.%m. %H:%M', time.localtime(last_seen))}"
+        return ""
+
     def add_host(self):
         AddHostDialog(self.root, self.db_path, self.load_data)
 
@@ -117,74 +126,15 @@ class ConfigHostsWindow:
             values = self.tree.item(item, 'values')
             host = values[0]
             try:
-                con = sqlite3.connect(str(self.db_path))
+                con = db.connect(self.db_path)
                 with con:
                     con.execute("DELETE FROM hosts WHERE host = ?", (host,))
-                con.close()
             except Exception as e:
                 logging.error(f"Error deleting {host}: {e}")
         self.load_data()
 
     def auto_scan(self):
-        default_subnet = "192.168.1.0/24"
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(('10.255.255.255', 1))
-            local_ip = s.getsockname()[0]
-            s.close()
-            default_subnet = str(ipaddress.IPv4Network(f"{local_ip}/24", strict=False))
-        except Exception:
-            pass
-
-        subnet_str = simpledialog.askstring("Auto Scan", "Enter IPv4 Subnet (CIDR):", initialvalue=default_subnet, parent=self.root)
-        if not subnet_str: return
-
-        try:
-            network = ipaddress.IPv4Network(subnet_str, strict=False)
-        except ValueError:
-            messagebox.showerror("Error", "Invalid subnet format")
-            return
-
-        self.scan_btn.config(state=tk.DISABLED, text="Scanning...")
-        
-        def run_scan():
-            found = []
-            with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                futures = {executor.submit(self.check_ssh_port, str(ip)): str(ip) for ip in network.hosts()}
-                for future in concurrent.futures.as_completed(futures):
-                    if future.result():
-                        found.append(futures[future])
-            self.root.after(0, lambda: self.finish_scan(found))
-
-        threading.Thread(target=run_scan, daemon=True).start()
-
-    def check_ssh_port(self, ip):
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1.0)
-            sock.connect((ip, 8022))
-            banner = sock.recv(1024)
-            sock.close()
-            if b'SSH' in banner:
-                return True
-        except Exception:
-            pass
-        return False
-
-    def finish_scan(self, hosts):
-        if hosts:
-            try:
-                con = sqlite3.connect(str(self.db_path))
-                with con:
-                    for host in hosts:
-                        con.execute("INSERT OR IGNORE INTO hosts (host, battery_threshold, storage_threshold, port) VALUES (?, 15, 1024, 8022)", (host,))
-                con.close()
-                self.load_data()
-            except Exception as e:
-                logging.error(f"Scan save error: {e}")
-        
-        self.scan_btn.config(state=tk.NORMAL, text="Auto Scan")
-        messagebox.showinfo("Scan Complete", f"Scan finished. Found {len(hosts)} hosts.")
+        ScanDialog(self.root, self.db_path, self.load_data)
 
     def on_close(self):
         self.root.destroy()
@@ -200,11 +150,10 @@ class ConfigHostsWindow:
     def save_key(self):
         path = self.key_var.get().strip()
         try:
-            con = sqlite3.connect(str(self.db_path))
+            con = db.connect(self.db_path)
             with con:
                 con.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
                 con.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('ssh_key_path', ?)", (path,))
-            con.close()
             messagebox.showinfo("Success", "SSH Key path saved.")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save key: {e}")
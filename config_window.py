@@ -1,12 +1,30 @@
 import logging
-import sqlite3
 import tkinter as tk
 from tkinter import messagebox
 
-from host_checker import common
+from host_checker import checks, common, db, notifications
 from ui.tools import Tools
 
 
+# (settings key, label, default) of the integer settings shown in the "Checks" section
+INT_SETTINGS = [
+    ('host_check_concurrency', "Concurrent host checks:", checks.DEFAULT_HOST_CHECK_CONCURRENCY),
+    ('host_check_interval', "Host check interval (s):", checks.DEFAULT_HOST_CHECK_INTERVAL),
+    ('task_check_interval', "Task check interval (s):", checks.DEFAULT_TASK_CHECK_INTERVAL),
+    ('checksum_check_interval', "Checksum check interval (s):", checks.DEFAULT_CHECKSUM_CHECK_INTERVAL),
+    ('host_check_timeout', "Host check timeout (s):", checks.DEFAULT_HOST_CHECK_TIMEOUT),
+    ('host_probe_timeout', "Reachability probe timeout (s, 0=off):", checks.DEFAULT_HOST_PROBE_TIMEOUT),
+    ('host_backoff_max', "Max backoff of unreachable hosts (s):", checks.DEFAULT_HOST_BACKOFF_MAX),
+    ('notify_min_interval', "Min time between notifications (s):", notifications.DEFAULT_MIN_INTERVAL),
+    ('checksum_recheck_days', "Checksum recheck period (days):", checks.DEFAULT_CHECKSUM_RECHECK_DAYS),
+    ('checksum_budget_gb', "Checksum budget per cycle (GB):", checks.DEFAULT_CHECKSUM_BUDGET_GB),
+    ('hash_max_devices', "Drives hashed in parallel:", checks.DEFAULT_MAX_DEVICES),
+    ('resumable_hash_min_mb', "Checkpoint hashing of files over (MB):", checks.DEFAULT_RESUMABLE_MIN_MB),
+    ('hash_cache_max_age_days', "Force full rehash after (days, 0=always):", checks.DEFAULT_CACHE_MAX_AGE_DAYS),
+    ('hash_rate_limit_mb', "Hashing rate limit (MB/s, 0=none):", checks.DEFAULT_RATE_LIMIT_MB),
+    ('hash_pause_load_pct', "Pause hashing above load (%, 0=never):", checks.DEFAULT_PAUSE_LOAD_PCT),
+]
+
 class ConfigWindow:
     def __init__(self, root, db_path, update_checker):
         self.db_path = db_path
@@ -15,6 +33,8 @@ class ConfigWindow:
         self.root.title(f"{common.APPNAME} Settings")
         
         self.var_updates = tk.BooleanVar(value=True)
+        self.var_low_priority = tk.BooleanVar(value=checks.DEFAULT_LOW_PRIORITY != 0)
+        self.int_vars = {key: tk.StringVar(value=str(default)) for key, _, default in INT_SETTINGS}
         
         frame = tk.Frame(self.root, padx=10, pady=10)
         frame.pack(fill=tk.BOTH, expand=True)
@@ -26,6 +46,14 @@ class ConfigWindow:
         tk.Checkbutton(lf_updates, text="Check for updates automatically", variable=self.var_updates).pack(anchor=tk.W, padx=5, pady=5)
         tk.Button(lf_updates, text="Check Now", command=self.check_now).pack(anchor=tk.W, padx=5, pady=5)
         
+        # Checks
+        lf_checks = tk.LabelFrame(frame, text="Checks")
+        lf_checks.pack(fill=tk.X, pady=5)
+        for i, (key, label, _) in enumerate(INT_SETTINGS):
+            tk.Label(lf_checks, text=label).grid(row=i, column=0, padx=5, pady=2, sticky="e")
+            tk.Entry(lf_checks, textvariable=self.int_vars[key], width=10).grid(row=i, column=1, padx=5, pady=2, sticky="w")
+        tk.Checkbutton(lf_checks, text="Hash at low priority", variable=self.var_low_priority).grid(row=len(INT_SETTINGS), column=0, columnspan=2, padx=5, pady=2, sticky="w")
+        
         # Save/Cancel
         btn_frame = tk.Frame(frame)
         btn_frame.pack(fill=tk.X, pady=10)
@@ -33,27 +61,44 @@ class ConfigWindow:
         tk.Button(btn_frame, text="Cancel", command=self.root.destroy).pack(side=tk.LEFT)
         
         self.load_settings()
-        Tools.center_window(self.root, 300, 200)
+        Tools.center_window(self.root, 360, 555)
 
     def load_settings(self):
         try:
-            con = sqlite3.connect(str(self.db_path))
+            con = db.connect(self.db_path)
             cur = con.cursor()
             cur.execute("SELECT value FROM settings WHERE key='update_check_enabled'")
             row = cur.fetchone()
             if row:
                 self.var_updates.set(row[0] == '1')
-            con.close()
+            cur.execute("SELECT value FROM settings WHERE key='hash_low_priority'")
+            row = cur.fetchone()
+            if row and row[0]:
+                self.var_low_priority.set(row[0].strip() != '0')
+            for key, _, _ in INT_SETTINGS:
+                cur.execute("SELECT value FROM settings WHERE key=?", (key,))
+                row = cur.fetchone()
+                if row and row[0]:
+                    self.int_vars[key].set(row[0])
         except Exception as e:
             logging.error(f"Failed to load settings: {e}")
 
     def save(self):
         enabled = self.var_updates.get()
+        int_values = {}
+        for key, label, _ in INT_SETTINGS:
+            try:
+                int_values[key] = int(self.int_vars[key].get().strip())
+            except ValueError:
+                messagebox.showerror("Error", f"{label.rstrip(':')} must be an integer")
+                return
         try:
-            con = sqlite3.connect(str(self.db_path))
+            con = db.connect(self.db_path)
             with con:
                 con.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('update_check_enabled', ?)", ('1' if enabled else '0',))
-            con.close()
+                con.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('hash_low_priority', ?)", ('1' if self.var_low_priority.get() else '0',))
+                for key, value in int_values.items():
+                    con.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
             
             if self.update_checker:
                 if enabled:
@@ -0,0 +1,101 @@
+import concurrent.futures
+import queue
+import threading
+import time
+
+
+# A minimal ThreadPoolExecutor whose threads are daemon threads. The standard executor's threads
+# are joined at interpreter exit, so a check stuck in a read or a subprocess that never notices
+# the shutdown would keep the app from quitting; these threads are simply dropped.
+class DaemonThreadPool:
+    def __init__(self, max_workers, thread_name_prefix='', initializer=None):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self.initializer = initializer
+        self._queue = queue.SimpleQueue()
+        self._threads = []
+        # threads told to exit by set_max_workers that haven't yet
+        self._retiring = 0
+        self._spawned = 0
+        # threads waiting for work and work not yet taken by a thread; a thread takes an item
+        # and leaves the idle ones in one step, so a new thread is needed while idle < pending
+        self._idle = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            self._queue.put((future, fn, args))
+            self._pending += 1
+            if self._idle < self._pending and len(self._threads) - self._retiring < self.max_workers:
+                thread = threading.Thread(target=self._work, name=f"{self.thread_name_prefix}_{self._spawned}", daemon=True)
+                self._spawned += 1
+                self._threads.append(thread)
+                thread.start()
+        return future
+
+    def _work(self):
+        if self.initializer is not None:
+            self.initializer()
+        while True:
+            with self._lock:
+                self._idle += 1
+            item = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+                if item is None:
+                    self._threads.remove(threading.current_thread())
+                    self._retiring = max(0, self._retiring - 1)
+                    return
+                self._pending -= 1
+            future, fn, args = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+            del item, future
+
+    def set_max_workers(self, max_workers):
+        # surplus threads exit once they are done with the work queued before the change
+        with self._lock:
+            if self._shutdown:
+                return
+            for _ in range(len(self._threads) - self._retiring - max_workers):
+                self._queue.put(None)
+                self._retiring += 1
+            self.max_workers = max_workers
+
+    def map(self, fn, items) -> list:
+        # results in the order of items; raises the first exception a call raised
+        futures = [self.submit(fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True, cancel_futures=False, timeout=None):
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        item[0].cancel()
+            for _ in self._threads:
+                self._queue.put(None)
+            threads = list(self._threads)
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for thread in threads:
+                thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown(wait=True)
@@ -0,0 +1,103 @@
+import sqlite3
+import threading
+
+import host_checker.common as common
+
+# how long a writer waits for another thread's or process' transaction before giving up
+BUSY_TIMEOUT = 15
+
+_local = threading.local()
+
+
+def connect(db_path=None) -> sqlite3.Connection:
+    # Returns the calling thread's long-lived connection. Don't close it; it is reused by
+    # every later call on the same thread and closed when the thread ends.
+    path = str(db_path or common.DB_PATH)
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    con = connections.get(path)
+    if con is None:
+        con = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        # WAL lets the GUI read while the worker writes, and makes commits cheap
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        connections[path] = con
+    return con
+
+def close():
+    connections = getattr(_local, 'connections', None)
+    if connections:
+        for con in connections.values():
+            con.close()
+        connections.clear()
+
+def _add_column(con, table, column, decl) -> bool:
+    columns = [row[1] for row in con.execute(f"PRAGMA table_info({table})")]
+    if column in columns:
+        return False
+    con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+def _text_column(con, table, column, create):
+    # recreates the table with the column declared TEXT, converting the stored values
+    types = {row[1]: row[2] for row in con.execute(f"PRAGMA table_info({table})")}
+    if types.get(column, 'TEXT').upper() == 'TEXT':
+        return
+    columns = ', '.join(f"CAST({name} AS TEXT)" if name == column else name for name in types)
+    con.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    con.execute(create)
+    con.execute(f"INSERT INTO {table} SELECT {columns} FROM {table}_old")
+    con.execute(f"DROP TABLE {table}_old")
+
+def init_db():
+    con = connect()
+    with con:
+        con.execute("CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, battery_threshold INTEGER, storage_threshold INTEGER, port INTEGER)")
+        con.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        con.execute("CREATE TABLE IF NOT EXISTS task_status (filename TEXT PRIMARY KEY, timeout_hours INTEGER, last_run TIMESTAMP, status TEXT)")
+        con.execute("CREATE TABLE IF NOT EXISTS checksum_files (path TEXT, last_check TIMESTAMP, status TEXT, host TEXT DEFAULT '', PRIMARY KEY (host, path))")
+        # inodes are stored as text, they can be wider than 64 bits
+        hash_cache = "CREATE TABLE IF NOT EXISTS hash_cache (dev INTEGER, ino TEXT, size INTEGER, mtime_ns INTEGER, sha256 TEXT, hashed_at TIMESTAMP, PRIMARY KEY (dev, ino))"
+        hash_checkpoints = "CREATE TABLE IF NOT EXISTS hash_checkpoints (path TEXT PRIMARY KEY, dev INTEGER, ino TEXT, size INTEGER, mtime_ns INTEGER, offset INTEGER, state BLOB, updated TIMESTAMP)"
+        con.execute(hash_cache)
+        con.execute(hash_checkpoints)
+        _text_column(con, "hash_cache", "ino", hash_cache)
+        _text_column(con, "hash_checkpoints", "ino", hash_checkpoints)
+        con.execute("CREATE TABLE IF NOT EXISTS battery_samples (host TEXT, ts TIMESTAMP, percentage INTEGER, status TEXT, free_mb REAL)")
+        con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_battery_samples_host_ts ON battery_samples (host, ts)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_task_status_status ON task_status (status)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_checksum_files_status ON checksum_files (status)")
+        _add_column(con, "checksum_files", "size_bytes", "INTEGER")
+        if _add_column(con, "checksum_files", "next_due", "TIMESTAMP"):
+            con.execute("UPDATE checksum_files SET next_due = last_check + 7 * 86400")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_checksum_files_next_due ON checksum_files (next_due)")
+        _add_column(con, "checksum_files", "manifest_mtime_ns", "INTEGER")
+        con.execute("CREATE TABLE IF NOT EXISTS checksum_entries (host TEXT, manifest TEXT, file TEXT, expected TEXT, last_verified TIMESTAMP, status TEXT, PRIMARY KEY (host, manifest, file))")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_checksum_entries_status ON checksum_entries (host, manifest, status)")
+        # fingerprint of the file at its last passing full verification, for quick checks
+        _add_column(con, "checksum_entries", "size", "INTEGER")
+        _add_column(con, "checksum_entries", "mtime_ns", "INTEGER")
+        _add_column(con, "checksum_entries", "sample", "TEXT")
+        # when the quick check last read the entry's sampled blocks
+        _add_column(con, "checksum_entries", "sampled_at", "TIMESTAMP")
+        # start of the unfinished verification pass of a remote manifest
+        _add_column(con, "checksum_files", "sweep_started", "TIMESTAMP")
+        # reachability backoff of hosts that didn't answer
+        _add_column(con, "hosts", "failures", "INTEGER DEFAULT 0")
+        _add_column(con, "hosts", "retry_at", "TIMESTAMP")
+        _add_column(con, "hosts", "last_seen", "TIMESTAMP")
+        # problems that were already notified, by the source that reported them
+        con.execute("CREATE TABLE IF NOT EXISTS alerts (source TEXT, key TEXT, state TEXT, message TEXT, since TIMESTAMP, PRIMARY KEY (source, key))")
+
+def get_setting(key, default=None):
+    cur = connect().execute("SELECT value FROM settings WHERE key = ?", (key,))
+    row = cur.fetchone()
+    if row and row[0] not in (None, ''):
+        return row[0]
+    return default
+
+def set_setting(key, value):
+    con = connect()
+    with con:
+        con.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
@@ -0,0 +1,241 @@
+import ctypes
+import ctypes.wintypes
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+# how often the polling fallback rescans the directory
+POLL_INTERVAL = 10
+_EVENT_BUFFER = 64 * 1024
+
+
+# Reports which files with a given suffix in a directory were created, changed, renamed or
+# deleted. Uses inotify on Linux and ReadDirectoryChangesW on Windows, and falls back to
+# comparing directory listings every POLL_INTERVAL seconds if neither is available.
+# changes() returns None when events were lost and the caller should rescan everything.
+class DirWatcher:
+    def __init__(self, path, suffix=''):
+        self.path = str(path)
+        self.suffix = suffix
+        self._backend = None
+        try:
+            if sys.platform.startswith('linux'):
+                self._backend = _InotifyBackend(self.path)
+            elif sys.platform == 'win32':
+                self._backend = _ReadDirectoryChangesBackend(self.path)
+        except OSError as e:
+            logging.warning(f"Can't watch {self.path} for changes, polling it instead: {e}")
+        if self._backend is None:
+            self._backend = _PollingBackend(self.path, suffix)
+
+    @property
+    def method(self) -> str:
+        return self._backend.method
+
+    def changes(self, timeout):
+        # waits up to timeout seconds for changes; returns the set of changed names (empty if none)
+        names = self._backend.changes(timeout)
+        if names is None:
+            return None
+        return {name for name in names if name.endswith(self.suffix)}
+
+    def close(self):
+        self._backend.close()
+
+
+class _InotifyBackend:
+    method = 'inotify'
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    # A watch ends when the directory is deleted or unmounted (IN_IGNORED) and no longer follows
+    # the path once the directory is moved away, so in both cases it is added again by path, as
+    # soon as a directory exists there again.
+    def __init__(self, path):
+        self.path = path
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wd = -1
+        if not self._add_watch():
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno), path)
+
+    def _add_watch(self) -> bool:
+        mask = (self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+                | self.IN_DELETE_SELF | self.IN_MOVE_SELF)
+        self.wd = self.libc.inotify_add_watch(self.fd, os.fsencode(self.path), mask)
+        return self.wd >= 0
+
+    def changes(self, timeout):
+        if self.wd < 0:
+            # the directory is gone; report a rescan once it's back
+            if self._add_watch():
+                logging.info(f"Watching {self.path} again")
+                return None
+            time.sleep(timeout)
+            return set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, _EVENT_BUFFER)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+            offset += 16 + length
+            if mask & self.IN_Q_OVERFLOW:
+                return None
+            if wd != self.wd:
+                # left over from a watch that was replaced
+                continue
+            if mask & (self.IN_IGNORED | self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                logging.warning(f"{self.path} was removed or moved, watching it again once it exists")
+                if not mask & self.IN_IGNORED:
+                    self.libc.inotify_rm_watch(self.fd, self.wd)
+                self.wd = -1
+                self._add_watch()
+                return None
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Overlapped(ctypes.Structure):
+    _fields_ = [('Internal', ctypes.c_void_p), ('InternalHigh', ctypes.c_void_p), ('Offset', ctypes.wintypes.DWORD),
+                ('OffsetHigh', ctypes.wintypes.DWORD), ('hEvent', ctypes.wintypes.HANDLE)]
+
+
+class _ReadDirectoryChangesBackend:
+    method = 'ReadDirectoryChangesW'
+    FILE_LIST_DIRECTORY = 0x1
+    FILE_SHARE_ALL = 0x7
+    OPEN_EXISTING = 3
+    FILE_FLAG_BACKUP_SEMANTICS = 0x02000000
+    FILE_FLAG_OVERLAPPED = 0x40000000
+    FILE_NOTIFY_CHANGE_FILE_NAME = 0x1
+    FILE_NOTIFY_CHANGE_SIZE = 0x8
+    FILE_NOTIFY_CHANGE_LAST_WRITE = 0x10
+    WAIT_OBJECT_0 = 0
+    INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+
+    def __init__(self, path):
+        k32 = self.k32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        k32.CreateFileW.restype = ctypes.wintypes.HANDLE
+        k32.CreateFileW.argtypes = [ctypes.wintypes.LPCWSTR, ctypes.wintypes.DWORD, ctypes.wintypes.DWORD, ctypes.c_void_p,
+                                    ctypes.wintypes.DWORD, ctypes.wintypes.DWORD, ctypes.wintypes.HANDLE]
+        k32.CreateEventW.restype = ctypes.wintypes.HANDLE
+        k32.CreateEventW.argtypes = [ctypes.c_void_p, ctypes.wintypes.BOOL, ctypes.wintypes.BOOL, ctypes.wintypes.LPCWSTR]
+        k32.ReadDirectoryChangesW.argtypes = [ctypes.wintypes.HANDLE, ctypes.c_void_p, ctypes.wintypes.DWORD, ctypes.wintypes.BOOL,
+                                              ctypes.wintypes.DWORD, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
+        k32.WaitForSingleObject.argtypes = [ctypes.wintypes.HANDLE, ctypes.wintypes.DWORD]
+        k32.WaitForSingleObject.restype = ctypes.wintypes.DWORD
+        k32.GetOverlappedResult.argtypes = [ctypes.wintypes.HANDLE, ctypes.c_void_p, ctypes.POINTER(ctypes.wintypes.DWORD), ctypes.wintypes.BOOL]
+        k32.CancelIoEx.argtypes = [ctypes.wintypes.HANDLE, ctypes.c_void_p]
+        k32.CloseHandle.argtypes = [ctypes.wintypes.HANDLE]
+        k32.ResetEvent.argtypes = [ctypes.wintypes.HANDLE]
+
+        self.handle = k32.CreateFileW(path, self.FILE_LIST_DIRECTORY, self.FILE_SHARE_ALL, None, self.OPEN_EXISTING,
+                                      self.FILE_FLAG_BACKUP_SEMANTICS | self.FILE_FLAG_OVERLAPPED, None)
+        if self.handle in (None, self.INVALID_HANDLE_VALUE):
+            raise ctypes.WinError(ctypes.get_last_error())
+        self.event = k32.CreateEventW(None, True, False, None)
+        self.overlapped = _Overlapped(hEvent=self.event)
+        # must stay alive while a read is pending
+        self.buffer = ctypes.create_string_buffer(_EVENT_BUFFER)
+        self.pending = False
+
+    def changes(self, timeout):
+        k32 = self.k32
+        if not self.pending:
+            k32.ResetEvent(self.event)
+            flags = self.FILE_NOTIFY_CHANGE_FILE_NAME | self.FILE_NOTIFY_CHANGE_SIZE | self.FILE_NOTIFY_CHANGE_LAST_WRITE
+            if not k32.ReadDirectoryChangesW(self.handle, self.buffer, len(self.buffer), False, flags, None, ctypes.byref(self.overlapped), None):
+                raise ctypes.WinError(ctypes.get_last_error())
+            self.pending = True
+        if k32.WaitForSingleObject(self.event, int(timeout * 1000)) != self.WAIT_OBJECT_0:
+            return set()
+        self.pending = False
+        size = ctypes.wintypes.DWORD()
+        if not k32.GetOverlappedResult(self.handle, ctypes.byref(self.overlapped), ctypes.byref(size), False) or size.value == 0:
+            # the buffer overflowed and the changes are lost
+            return None
+        data = self.buffer.raw[:size.value]
+        names = set()
+        offset = 0
+        while True:
+            next_offset, _, length = struct.unpack_from('<III', data, offset)
+            names.add(data[offset + 12:offset + 12 + length].decode('utf-16-le'))
+            if next_offset == 0:
+                return names
+            offset += next_offset
+
+    def close(self):
+        if self.pending:
+            self.k32.CancelIoEx(self.handle, None)
+            size = ctypes.wintypes.DWORD()
+            self.k32.GetOverlappedResult(self.handle, ctypes.byref(self.overlapped), ctypes.byref(size), True)
+        self.k32.CloseHandle(self.handle)
+        self.k32.CloseHandle(self.event)
+
+
+class _PollingBackend:
+    method = 'polling'
+
+    def __init__(self, path, suffix):
+        self.path = path
+        self.suffix = suffix
+        self.snapshot = self._scan()
+        self.next_scan = time.monotonic() + POLL_INTERVAL
+
+    def _scan(self):
+        entries = {}
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if entry.name.endswith(self.suffix):
+                        try:
+                            st = entry.stat()
+                            entries[entry.name] = (st.st_mtime_ns, st.st_size)
+                        except OSError:
+                            pass
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def changes(self, timeout):
+        wait = self.next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(0.0, wait))
+        self.next_scan = time.monotonic() + POLL_INTERVAL
+        snapshot = self._scan()
+        names = {name for name in snapshot.keys() | self.snapshot.keys() if snapshot.get(name) != self.snapshot.get(name)}
+        self.snapshot = snapshot
+        return names
+
+    def close(self):
+        pass
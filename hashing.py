@@ -0,0 +1,813 @@
+import collections
+import contextlib
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+import os
+import platform
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import host_checker.common as common
+import host_checker.db as db
+from host_checker.daemon_pool import DaemonThreadPool
+
+HASH_CHUNK_SIZE = 8192 * 1024
+# manifest entries per verify_entries batch and per on_results call; bounds memory for huge manifests
+MANIFEST_BATCH = 512
+# files queued for the reader of each device; further entries wait in their manifests
+DEVICE_QUEUE = 64
+DEFAULT_MAX_DEVICES = 4
+DEFAULT_CACHE_MAX_AGE_DAYS = 30
+DEFAULT_RESUMABLE_MIN_MB = 1024
+CHECKPOINT_INTERVAL = 256 * 1024**2
+# size of each of the blocks a quick check hashes
+QUICK_SAMPLE_SIZE = 64 * 1024
+DEFAULT_RATE_LIMIT_MB = 0
+DEFAULT_LOW_PRIORITY = 1
+DEFAULT_PAUSE_LOAD_PCT = 90
+# longest time the hashing threads of one pass wait in total for the system to become idle, so
+# hashing still progresses on a machine that's always busy
+MAX_LOAD_PAUSE = 1800
+
+
+def _read_into(f, buf, throttle=None):
+    # yields views of buf filled from f, reusing the one buffer for the whole file
+    view = memoryview(buf)
+    while n := f.readinto(buf):
+        common.check_cancelled()
+        if throttle is not None:
+            throttle(n)
+        yield view[:n]
+
+def hash_file(path, buf=None, throttle=None) -> str:
+    # hashlib.file_digest() runs the same readinto loop with a 256 KB buffer; an own loop lets
+    # the caller reuse one large buffer per hashing thread
+    buf = buf if buf is not None else bytearray(HASH_CHUNK_SIZE)
+    sha256 = hashlib.sha256()
+    with open(path, 'rb', buffering=0) as f:
+        for chunk in _read_into(f, buf, throttle):
+            sha256.update(chunk)
+    return sha256.hexdigest().lower()
+
+
+class _FileTime(ctypes.Structure):
+    _fields_ = [('low', ctypes.c_uint32), ('high', ctypes.c_uint32)]
+
+    def value(self) -> int:
+        return self.high << 32 | self.low
+
+
+# Tells whether the machine is busy with something other than hashing: the CPU usage of other
+# processes since the previous sample on Windows, the one minute load average per CPU minus the
+# hashing threads elsewhere. Samples at most once per second.
+class LoadMonitor:
+    def __init__(self, max_load_pct):
+        self.max_load = max_load_pct / 100.0
+        self._lock = threading.Lock()
+        self._sampled = 0.0
+        self._busy = False
+        self._times = self._cpu_times() if sys.platform == 'win32' else None
+
+    @staticmethod
+    def _cpu_times():
+        idle, kernel, user = _FileTime(), _FileTime(), _FileTime()
+        ctypes.windll.kernel32.GetSystemTimes(ctypes.byref(idle), ctypes.byref(kernel), ctypes.byref(user))
+        # this process' own CPU time (GetProcessTimes), in the same 100 ns units
+        return idle.value(), kernel.value() + user.value(), time.process_time_ns() // 100
+
+    def _load(self, own_threads) -> float:
+        if sys.platform == 'win32':
+            idle, total, own = self._cpu_times()
+            prev_idle, prev_total, prev_own = self._times
+            self._times = idle, total, own
+            # kernel time includes idle time
+            return 1.0 - ((idle - prev_idle) + (own - prev_own)) / (total - prev_total) if total > prev_total else 0.0
+        return max(0.0, os.getloadavg()[0] - own_threads) / (os.cpu_count() or 1)
+
+    def busy(self, own_threads=0) -> bool:
+        # own_threads is the number of threads of this process that are hashing
+        if self.max_load <= 0:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._sampled >= 1.0:
+                self._sampled = now
+                try:
+                    self._busy = self._load(own_threads) > self.max_load
+                except (OSError, AttributeError):
+                    self._busy = False
+            return self._busy
+
+
+# Called with the size of every chunk read for hashing. Limits the combined read rate of all
+# hashing threads with a token bucket and holds reads back while the system is busy, for at most
+# MAX_LOAD_PAUSE seconds per pass (summed over the threads). Reading threads run inside
+# hashing(), so the load they cause themselves isn't taken for a busy system.
+class Throttle:
+    def __init__(self, rate_limit_mb=DEFAULT_RATE_LIMIT_MB, pause_load_pct=DEFAULT_PAUSE_LOAD_PCT):
+        self.rate = rate_limit_mb * 1024**2
+        self.load = LoadMonitor(pause_load_pct)
+        self._lock = threading.Lock()
+        self._tokens = self.rate
+        self._last = time.monotonic()
+        self.paused = 0.0
+        self.active = 0
+
+    @contextlib.contextmanager
+    def hashing(self):
+        with self._lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def __call__(self, nbytes):
+        if self.rate > 0:
+            with self._lock:
+                now = time.monotonic()
+                # allows bursts of up to one second's worth of reads
+                self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate) - nbytes
+                self._last = now
+                delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if delay > 0:
+                common.shutdown_event.wait(delay)
+        start = time.monotonic()
+        while self.paused + time.monotonic() - start < MAX_LOAD_PAUSE and self.load.busy(self.active):
+            if common.shutdown_event.wait(1.0):
+                break
+        waited = time.monotonic() - start
+        if waited >= 1.0:
+            with self._lock:
+                self.paused += waited
+
+
+_IOPRIO_SET = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'armv7l': 314}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+_THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+
+def lower_thread_priority():
+    # Moves the calling thread to the lowest CPU and I/O priority. Can't be undone without privileges
+    # on Linux, so it's only meant for threads that do nothing but hashing.
+    try:
+        if sys.platform == 'win32':
+            # background mode lowers both the CPU and the I/O priority of the thread
+            ctypes.windll.kernel32.SetThreadPriority(ctypes.windll.kernel32.GetCurrentThread(), _THREAD_MODE_BACKGROUND_BEGIN)
+        elif sys.platform.startswith('linux'):
+            # niceness and I/O priority are per thread on Linux
+            tid = threading.get_native_id()
+            os.setpriority(os.PRIO_PROCESS, tid, 19)
+            nr = _IOPRIO_SET.get(platform.machine())
+            if nr is not None:
+                ctypes.CDLL(None, use_errno=True).syscall(nr, _IOPRIO_WHO_PROCESS, tid, _IOPRIO_CLASS_IDLE << 13)
+        else:
+            os.setpriority(os.PRIO_PROCESS, 0, 19)
+    except (OSError, AttributeError) as e:
+        logging.warning(f"Failed to lower hashing priority: {e}")
+
+
+class _Sha256Ctx(ctypes.Structure):
+    # OpenSSL's SHA256_CTX, which has had this public layout since 0.9.8
+    _fields_ = [('h', ctypes.c_uint32 * 8), ('Nl', ctypes.c_uint32), ('Nh', ctypes.c_uint32),
+                ('data', ctypes.c_uint32 * 16), ('num', ctypes.c_uint32), ('md_len', ctypes.c_uint32)]
+
+def _load_libcrypto():
+    if sys.platform == 'win32':
+        # the copy that ships with Python and is already loaded by hashlib
+        names = ['libcrypto-3-x64', 'libcrypto-3', 'libcrypto-1_1-x64', 'libcrypto-1_1']
+    else:
+        names = [ctypes.util.find_library('crypto')]
+    for name in names:
+        if not name:
+            continue
+        try:
+            lib = ctypes.CDLL(name)
+            lib.SHA256_Init.argtypes = [ctypes.POINTER(_Sha256Ctx)]
+            lib.SHA256_Update.argtypes = [ctypes.POINTER(_Sha256Ctx), ctypes.c_void_p, ctypes.c_size_t]
+            lib.SHA256_Final.argtypes = [ctypes.c_char_p, ctypes.POINTER(_Sha256Ctx)]
+            return lib
+        except (OSError, AttributeError):
+            continue
+    return None
+
+_libcrypto = _load_libcrypto()
+
+
+# SHA-256 whose intermediate state can be saved and restored, which hashlib doesn't allow.
+# Uses OpenSSL's low level API through ctypes; unavailable if libcrypto can't be loaded.
+class ResumableSha256:
+    available = _libcrypto is not None
+
+    def __init__(self, state=None):
+        if state is None:
+            self._ctx = _Sha256Ctx()
+            _libcrypto.SHA256_Init(ctypes.byref(self._ctx))
+        else:
+            self._ctx = _Sha256Ctx.from_buffer_copy(state)
+
+    def update(self, data):
+        if not isinstance(data, bytes):
+            # pass writable buffers like views of a bytearray without copying them
+            data = (ctypes.c_char * len(data)).from_buffer(data)
+        _libcrypto.SHA256_Update(ctypes.byref(self._ctx), data, len(data))
+
+    def state(self) -> bytes:
+        return bytes(self._ctx)
+
+    def hexdigest(self) -> str:
+        ctx = _Sha256Ctx.from_buffer_copy(self._ctx)
+        out = ctypes.create_string_buffer(32)
+        _libcrypto.SHA256_Final(out, ctypes.byref(ctx))
+        return out.raw.hex()
+
+
+# Persists the hash state of large files every CHECKPOINT_INTERVAL bytes, so verifying
+# them resumes where it stopped after a quit, crash or reboot. A checkpoint only applies
+# while the file's (device, inode, size, mtime) are unchanged.
+class HashCheckpoints:
+    def __init__(self, db_path, min_size_mb=DEFAULT_RESUMABLE_MIN_MB):
+        self.db_path = db_path
+        self.min_size = min_size_mb * 1024**2
+
+    def applies_to(self, st) -> bool:
+        return ResumableSha256.available and st.st_size >= self.min_size and _has_identity(st)
+
+    def load(self, path, st):
+        row = db.connect(self.db_path).execute("SELECT dev, ino, size, mtime_ns, offset, state FROM hash_checkpoints WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        if tuple(row[:4]) != _fingerprint(st):
+            self.delete(path)
+            return None
+        return row[4], row[5]
+
+    def save(self, path, st, offset, state):
+        con = db.connect(self.db_path)
+        with con:
+            con.execute("INSERT OR REPLACE INTO hash_checkpoints (path, dev, ino, size, mtime_ns, offset, state, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (path, *_fingerprint(st), offset, state, time.time()))
+
+    def delete(self, path):
+        con = db.connect(self.db_path)
+        with con:
+            con.execute("DELETE FROM hash_checkpoints WHERE path = ?", (path,))
+
+    def hash_file(self, path, st, buf=None, throttle=None) -> str:
+        saved = self.load(path, st)
+        if saved:
+            offset, state = saved
+            sha256 = ResumableSha256(state)
+            logging.info(f"Resuming hash of {path} at {offset / 1024**3:.1f} GB")
+        else:
+            offset = 0
+            sha256 = ResumableSha256()
+        buf = buf if buf is not None else bytearray(HASH_CHUNK_SIZE)
+        with open(path, 'rb', buffering=0) as f:
+            f.seek(offset)
+            start = offset
+            next_checkpoint = offset + CHECKPOINT_INTERVAL
+            try:
+                for chunk in _read_into(f, buf, throttle):
+                    sha256.update(chunk)
+                    offset += len(chunk)
+                    if offset >= next_checkpoint:
+                        self.save(path, st, offset, sha256.state())
+                        next_checkpoint = offset + CHECKPOINT_INTERVAL
+            except common.Cancelled:
+                # keep what was read since the last checkpoint
+                if offset > start:
+                    self.save(path, st, offset, sha256.state())
+                raise
+        if saved or offset >= CHECKPOINT_INTERVAL:
+            self.delete(path)
+        return sha256.hexdigest()
+
+def parse_manifest_lines(lines):
+    # yields the (expected_hash, filename) entries of sha256sum style manifest lines
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'): continue
+
+        parts = line.split(None, 1)
+        if len(parts) != 2:
+            continue
+        yield parts[0].lower(), parts[1].lstrip('*')
+
+def iter_manifest(checksum_file):
+    # lazily yields the (expected_hash, filename) entries of a manifest file
+    with open(checksum_file, 'r', encoding='utf-8', errors='ignore') as f:
+        yield from parse_manifest_lines(f)
+
+
+def manifest_size(checksum_file) -> int:
+    # total size of the files a manifest lists that currently exist
+    base_dir = os.path.dirname(checksum_file)
+    total = 0
+    for _, filename in iter_manifest(checksum_file):
+        common.check_cancelled()
+        try:
+            total += os.stat(os.path.join(base_dir, filename)).st_size
+        except OSError:
+            pass
+    return total
+
+def sample_digest(path, size, throttle=None) -> str:
+    # sha256 over a few blocks at the start, middle and end of a file
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - QUICK_SAMPLE_SIZE // 2), max(0, size - QUICK_SAMPLE_SIZE)}):
+            f.seek(offset)
+            block = f.read(QUICK_SAMPLE_SIZE)
+            if throttle is not None:
+                throttle(len(block))
+            h.update(block)
+    return h.hexdigest()
+
+def quick_check(path, size, mtime_ns, sample=None, throttle=None) -> str:
+    # Status of a file against the fingerprint recorded when it last passed a full verification.
+    # Catches deleted, truncated and replaced files with a stat and, if a sample is given, grossly
+    # damaged ones with a few small reads.
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 'missing'
+    except OSError:
+        return 'error'
+    if st.st_size != size or st.st_mtime_ns != mtime_ns:
+        return 'changed'
+    if sample is None:
+        return 'ok'
+    try:
+        if sample_digest(path, size, throttle) != sample:
+            return 'mismatch'
+    except OSError:
+        return 'error'
+    return 'ok'
+
+def _fingerprint(st):
+    # the inode as text, as ReFS file ids are 128 bits wide and don't fit in an sqlite INTEGER
+    return (st.st_dev, str(st.st_ino), st.st_size, st.st_mtime_ns)
+
+def _has_identity(st) -> bool:
+    # FAT, exFAT and some network shares report no file ids, which would make every file of
+    # the same size and mtime look like the same file
+    return st.st_ino != 0
+
+
+# Remembers computed digests keyed on (device, inode) and the file's size and mtime,
+# so unchanged files are verified with a single stat. Entries older than max_age_days
+# are ignored to force a full re-read now and then, which is what catches bit rot.
+class HashCache:
+    def __init__(self, db_path, max_age_days=DEFAULT_CACHE_MAX_AGE_DAYS):
+        self.db_path = db_path
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.hit_bytes = 0
+
+    def get(self, st):
+        if self.max_age <= 0 or not _has_identity(st):
+            return None
+        dev, ino, size, mtime_ns = _fingerprint(st)
+        cur = db.connect(self.db_path).execute("SELECT sha256 FROM hash_cache WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ? AND hashed_at > ?",
+                                         (dev, ino, size, mtime_ns, time.time() - self.max_age))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        self.hit_bytes += size
+        return row[0]
+
+    def put_many(self, items):
+        # items are (stat_result, digest) pairs
+        now = time.time()
+        con = db.connect(self.db_path)
+        with con:
+            con.executemany("INSERT OR REPLACE INTO hash_cache (dev, ino, size, mtime_ns, sha256, hashed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                            [(*_fingerprint(st), digest, now) for st, digest in items if _has_identity(st)])
+
+    def discard(self, paths):
+        # forgets the digests of files that failed verification; their size and mtime may still be
+        # those of the digest cached before the damage
+        keys = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            keys.append(_fingerprint(st)[:2])
+        con = db.connect(self.db_path)
+        with con:
+            con.executemany("DELETE FROM hash_cache WHERE dev = ? AND ino = ?", keys)
+
+
+# Digests an engine computed, keyed on the file's stat fingerprint. They are kept in a private
+# temporary sqlite database, which spills to a temp file, so a pass over millions of files doesn't
+# hold them all in memory.
+class _SeenDigests:
+    def __init__(self):
+        self._con = None
+
+    def get(self, key):
+        if self._con is None:
+            return None
+        row = self._con.execute("SELECT sha256 FROM seen WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?", key).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, items):
+        # items are (fingerprint, digest) pairs
+        if self._con is None:
+            # an empty name opens a database that is deleted when it's closed
+            self._con = sqlite3.connect('', check_same_thread=False)
+            self._con.execute("CREATE TABLE seen (dev INTEGER, ino TEXT, size INTEGER, mtime_ns INTEGER, sha256 TEXT, PRIMARY KEY (dev, ino, size, mtime_ns)) WITHOUT ROWID")
+        with self._con:
+            self._con.executemany("INSERT OR REPLACE INTO seen (dev, ino, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+                                  [(*key, digest) for key, digest in items])
+
+
+# Hashes files with one reader per storage device and the devices in parallel.
+# Concurrent readers on the same disk only add seeks, while separate disks scale
+# almost linearly. Threads are enough for this because hashlib releases the GIL
+# while hashing large buffers and file reads release it as well.
+class HashEngine:
+    def __init__(self, max_devices=DEFAULT_MAX_DEVICES, cache=None, checkpoints=None, throttle=None, low_priority=False):
+        self.max_devices = max(1, max_devices)
+        self.cache = cache
+        self.checkpoints = checkpoints
+        self.throttle = throttle
+        # hash in dedicated low priority threads instead of the calling thread
+        self.low_priority = low_priority
+        # digests computed by this engine keyed on the file's stat fingerprint, so a file listed
+        # in several manifests (or reached through several paths) is read only once per engine
+        self._seen = _SeenDigests()
+        self.dedup_files = 0
+        self.dedup_bytes = 0
+        # (size, mtime_ns, sample digest) of the files of the last hash_files call, for quick
+        # checks; the sample is only taken of files that were actually read, never of cache hits
+        self.fingerprints = {}
+        # paths that are always read, never taken from the hash cache, like files that failed before
+        self.uncached = set()
+        # total size of the files this engine read, i.e. that weren't hash cache hits or duplicates
+        self.read_bytes = 0
+        # total size of the existing files each manifest of the last verify_manifests call lists
+        self.manifest_bytes = {}
+
+    def hash_files(self, paths) -> dict:
+        # maps each path to its hex digest, or to the exception that prevented hashing it
+        results = {}
+        self.fingerprints = {}
+        by_device = {}
+        queued = {}
+        aliases = []
+        sizes = {}
+        # new digests for self._seen; files repeated within this call are caught by queued
+        seen = []
+        for path in paths:
+            if path in sizes:
+                # listed again under the same path
+                self.dedup_files += 1
+                self.dedup_bytes += sizes[path]
+                continue
+            if path in results:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                results[path] = e
+                continue
+            sizes[path] = st.st_size
+            self.fingerprints[path] = (st.st_size, st.st_mtime_ns, None)
+            if not _has_identity(st):
+                by_device.setdefault(st.st_dev, []).append((path, st))
+                continue
+            key = _fingerprint(st)
+            digest = self._seen.get(key)
+            if digest is not None:
+                results[path] = digest
+                self.dedup_files += 1
+                self.dedup_bytes += st.st_size
+                continue
+            if key in queued:
+                aliases.append((path, queued[key], st.st_size))
+                continue
+            queued[key] = path
+            if self.cache is not None and path not in self.uncached:
+                digest = self.cache.get(st)
+                if digest is not None:
+                    results[path] = digest
+                    seen.append((key, digest))
+                    continue
+            by_device.setdefault(st.st_dev, []).append((path, st))
+
+        hashed = []
+        if len(by_device) == 1 and not self.low_priority:
+            hashed.append(self._hash_group(next(iter(by_device.values()))))
+        elif by_device:
+            workers = min(len(by_device), self.max_devices)
+            with DaemonThreadPool(workers, thread_name_prefix="Hasher", initializer=lower_thread_priority if self.low_priority else None) as executor:
+                hashed.extend(executor.map(self._hash_group, by_device.values()))
+
+        cacheable = []
+        for group_results in hashed:
+            for path, (digest, st, sample) in group_results.items():
+                results[path] = digest
+                self.read_bytes += sizes[path]
+                if st is not None:
+                    cacheable.append((st, digest))
+                    if sample is not None:
+                        self.fingerprints[path] = (st.st_size, st.st_mtime_ns, sample)
+                    if _has_identity(st):
+                        seen.append((_fingerprint(st), digest))
+        for path, primary, size in aliases:
+            results[path] = results[primary]
+            self.dedup_files += 1
+            self.dedup_bytes += size
+        if self.cache is not None and cacheable:
+            self.cache.put_many(cacheable)
+        if seen:
+            self._seen.put_many(seen)
+        return results
+
+    def _hash_group(self, items) -> dict:
+        # maps path to (digest or exception, stat to cache the digest under or None, sample digest or None)
+        results = {}
+        buf = bytearray(HASH_CHUNK_SIZE)
+        with self.throttle.hashing() if self.throttle is not None else contextlib.nullcontext():
+            for path, st in items:
+                results[path] = self._hash_one(path, st, buf)
+        return results
+
+    def _hash_one(self, path, st, buf):
+        try:
+            if self.checkpoints is not None and self.checkpoints.applies_to(st):
+                digest = self.checkpoints.hash_file(path, st, buf, self.throttle)
+            else:
+                digest = hash_file(path, buf, self.throttle)
+            # only cache the digest if the file didn't change while it was read
+            after = os.stat(path)
+            if _fingerprint(after) != _fingerprint(st):
+                return digest, None, None
+            # the quick check sample, taken while the file is still in the page cache
+            try:
+                sample = sample_digest(path, st.st_size)
+            except OSError:
+                sample = None
+            return digest, st, sample
+        except Exception as e:
+            return e, None, None
+
+    def verify_manifests(self, checksum_files, on_results=None) -> dict:
+        # Maps each manifest to True if every listed file exists and matches its hash. Each device
+        # has a queue of files to read, fed from all manifests in turn, and a reader of its own, so
+        # a slow drive never holds up the others. A manifest whose next file is for a full queue
+        # waits while the other manifests go on, so memory stays flat however long they are.
+        # on_results, if given, receives chunks of (checksum_file, filename, expected_hash, status, size, mtime_ns, sample)
+        # rows; the fingerprint is None for failed entries, and the sample for files that weren't read.
+        results = {checksum_file: True for checksum_file in checksum_files}
+        self.manifest_bytes = {checksum_file: 0 for checksum_file in results}
+        manifests = {checksum_file: iter_manifest(checksum_file) for checksum_file in results}
+        verification = _VerifyPass(self, results, on_results)
+        with DaemonThreadPool(self.max_devices, thread_name_prefix="Hasher", initializer=lower_thread_priority if self.low_priority else None) as pool:
+            readers = _DeviceReaders(self, pool)
+            try:
+                # entries statted but not yet queued, one per manifest
+                held = {}
+                while manifests or verification.reading:
+                    common.check_cancelled()
+                    fed = False
+                    for checksum_file, entries in list(manifests.items()):
+                        entry = held.pop(checksum_file, None)
+                        if entry is None:
+                            try:
+                                expected_hash, filename = next(entries)
+                            except StopIteration:
+                                del manifests[checksum_file]
+                                continue
+                            except Exception as e:
+                                logging.error(f"Failed to read checksum file {checksum_file}: {e}")
+                                results[checksum_file] = False
+                                del manifests[checksum_file]
+                                continue
+                            entry = verification.stat(checksum_file, filename, expected_hash)
+                            if entry is None:
+                                fed = True
+                                continue
+                        if verification.start(entry, readers):
+                            fed = True
+                        else:
+                            held[checksum_file] = entry
+                    # wait for a reader only when no manifest could go on
+                    block = not fed and verification.reading
+                    while True:
+                        try:
+                            path, hashed = readers.done.get(timeout=1.0) if block else readers.done.get_nowait()
+                        except queue.Empty:
+                            break
+                        verification.finish(path, hashed)
+                        block = False
+            finally:
+                readers.stop()
+        verification.flush()
+        return results
+
+    def verify_entries(self, entries, on_results=None) -> dict:
+        # Like verify_manifests, but only for the given (checksum_file, filename, expected_hash) entries.
+        # Maps each checksum_file that occurs in entries to True if all its given entries match.
+        results = {}
+        batch = []
+        for entry in entries:
+            results.setdefault(entry[0], True)
+            batch.append(entry)
+            if len(batch) >= MANIFEST_BATCH:
+                self._verify_batch(batch, results, on_results)
+                batch = []
+        self._verify_batch(batch, results, on_results)
+        return results
+
+    def _verify_batch(self, batch, results, on_results):
+        if not batch:
+            return
+        common.check_cancelled()
+        targets = [os.path.join(os.path.dirname(checksum_file), filename) for checksum_file, filename, _ in batch]
+        digests = self.hash_files(target for target in targets if os.path.exists(target))
+        statuses = []
+        for (checksum_file, filename, expected_hash), target_path in zip(batch, targets):
+            status = _entry_status(target_path, digests.get(target_path), expected_hash)
+            fingerprint = (None, None, None)
+            if status != 'ok':
+                results[checksum_file] = False
+            else:
+                fingerprint = self.fingerprints.get(target_path, fingerprint)
+            statuses.append((checksum_file, filename, expected_hash, status, *fingerprint))
+        if on_results:
+            on_results(statuses)
+
+
+def _entry_status(target_path, digest, expected_hash) -> str:
+    # status of a manifest entry given its file's digest, the exception hashing it raised, or None if it's missing
+    if digest is None:
+        logging.error(f"File missing for checksum: {target_path}")
+        return 'missing'
+    if isinstance(digest, Exception):
+        logging.error(f"Error verifying {target_path}: {digest}")
+        return 'error'
+    if digest != expected_hash:
+        logging.error(f"Checksum mismatch for {target_path}")
+        return 'mismatch'
+    return 'ok'
+
+
+# Reads the files queued for each device, one reader per device at a time. A reader runs while its
+# device has files queued, and puts (path, (digest or exception, stat to cache the digest under or
+# None, sample digest or None)) on done for each of them.
+class _DeviceReaders:
+    def __init__(self, engine, pool):
+        self.engine = engine
+        self.pool = pool
+        self.done = queue.SimpleQueue()
+        self._queues = {}
+        self._active = set()
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def offer(self, path, st) -> bool:
+        # queues a file for reading unless its device's queue is full
+        with self._lock:
+            files = self._queues.setdefault(st.st_dev, collections.deque())
+            if len(files) >= DEVICE_QUEUE:
+                return False
+            files.append((path, st))
+            if st.st_dev not in self._active:
+                self._active.add(st.st_dev)
+                self.pool.submit(self._read, st.st_dev)
+        return True
+
+    def stop(self):
+        # readers return after the file they are reading
+        with self._lock:
+            self._stopped = True
+
+    def _read(self, dev):
+        buf = bytearray(HASH_CHUNK_SIZE)
+        throttle = self.engine.throttle
+        with throttle.hashing() if throttle is not None else contextlib.nullcontext():
+            while True:
+                with self._lock:
+                    files = self._queues[dev]
+                    if self._stopped or not files:
+                        self._active.discard(dev)
+                        return
+                    path, st = files.popleft()
+                self.done.put((path, self.engine._hash_one(path, st, buf)))
+
+
+# The bookkeeping of one verify_manifests call: which files are being read for which entries,
+# and the rows, cache entries and digests collected for the next on_results chunk.
+class _VerifyPass:
+    def __init__(self, engine, results, on_results):
+        self.engine = engine
+        self.results = results
+        self.on_results = on_results
+        # path being read -> (fingerprint or None, [(checksum_file, filename, expected_hash, st)] waiting for its digest)
+        self.reading = {}
+        # fingerprint -> path being read, so a file listed under several names is read once
+        self._reading_keys = {}
+        # digests not yet in the engine's _seen
+        self._fresh = {}
+        self._rows = []
+        self._cacheable = []
+
+    def stat(self, checksum_file, filename, expected_hash):
+        # (checksum_file, filename, expected_hash, path, st) of an entry, or None if its file is missing
+        path = os.path.join(os.path.dirname(checksum_file), filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._record(checksum_file, filename, expected_hash, _entry_status(path, None, expected_hash), None)
+            return None
+        self.engine.manifest_bytes[checksum_file] += st.st_size
+        return checksum_file, filename, expected_hash, path, st
+
+    def start(self, entry, readers) -> bool:
+        # settles an entry from earlier digests or the hash cache, or has its file read; False if
+        # the file's device queue is full
+        checksum_file, filename, expected_hash, path, st = entry
+        engine = self.engine
+        waiting = (checksum_file, filename, expected_hash, st)
+        if path in self.reading:
+            # listed again under the same path
+            self.reading[path][1].append(waiting)
+            engine.dedup_files += 1
+            engine.dedup_bytes += st.st_size
+            return True
+        key = None
+        if _has_identity(st):
+            key = _fingerprint(st)
+            digest = self._fresh.get(key) or engine._seen.get(key)
+            if digest is not None:
+                engine.dedup_files += 1
+                engine.dedup_bytes += st.st_size
+                self._settle(waiting, digest, (st.st_size, st.st_mtime_ns, None))
+                return True
+            if key in self._reading_keys:
+                self.reading[self._reading_keys[key]][1].append(waiting)
+                engine.dedup_files += 1
+                engine.dedup_bytes += st.st_size
+                return True
+            if engine.cache is not None and path not in engine.uncached:
+                digest = engine.cache.get(st)
+                if digest is not None:
+                    self._fresh[key] = digest
+                    self._settle(waiting, digest, (st.st_size, st.st_mtime_ns, None))
+                    return True
+        if not readers.offer(path, st):
+            return False
+        self.reading[path] = (key, [waiting])
+        if key is not None:
+            self._reading_keys[key] = path
+        return True
+
+    def finish(self, path, hashed):
+        # settles the entries that waited for a file that was read
+        digest, cache_st, sample = hashed
+        key, waiting = self.reading.pop(path)
+        self.engine.read_bytes += waiting[0][3].st_size
+        if key is not None:
+            del self._reading_keys[key]
+        if cache_st is not None:
+            self._cacheable.append((cache_st, digest))
+            if key is not None:
+                self._fresh[key] = digest
+        for i, entry in enumerate(waiting):
+            st = entry[3]
+            # only the entry the file was read for gets the sample, like the path it was taken of
+            self._settle(entry, digest, (st.st_size, st.st_mtime_ns, sample if i == 0 and cache_st is not None else None))
+
+    def _settle(self, waiting, digest, fingerprint):
+        checksum_file, filename, expected_hash, _ = waiting
+        target_path = os.path.join(os.path.dirname(checksum_file), filename)
+        self._record(checksum_file, filename, expected_hash, _entry_status(target_path, digest, expected_hash), fingerprint)
+
+    def _record(self, checksum_file, filename, expected_hash, status, fingerprint):
+        if status != 'ok':
+            self.results[checksum_file] = False
+            fingerprint = None
+        self._rows.append((checksum_file, filename, expected_hash, status, *(fingerprint or (None, None, None))))
+        if len(self._rows) >= MANIFEST_BATCH:
+            self.flush()
+
+    def flush(self):
+        engine = self.engine
+        if engine.cache is not None and self._cacheable:
+            engine.cache.put_many(self._cacheable)
+        if self._fresh:
+            engine._seen.put_many(self._fresh.items())
+        if self.on_results and self._rows:
+            self.on_results(self._rows)
+        self._rows, self._cacheable, self._fresh = [], [], {}
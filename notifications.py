@@ -0,0 +1,153 @@
+import logging
+import subprocess
+import threading
+import time
+
+import host_checker.common as common
+import host_checker.db as db
+
+# shortest time between two notifications; problems found in between are sent together
+DEFAULT_MIN_INTERVAL = 60
+# problems reported this soon after the first one are sent with it, so the checks of one cycle,
+# which finish a few seconds apart, make one notification
+COALESCE_DELAY = 10
+# problems listed by name in a digest, the rest are counted
+DIGEST_LINES = 3
+
+
+def _digest(messages):
+    # (title, body) of a notification about the given problem messages
+    if len(messages) == 1:
+        title, _, body = messages[0].partition('\n')
+        return title, body
+    lines = [message.split('\n', 1)[0] for message in messages[:DIGEST_LINES]]
+    if len(messages) > DIGEST_LINES:
+        lines.append(f"... and {len(messages) - DIGEST_LINES} more")
+    return f"{len(messages)} new problems", '\n'.join(lines)
+
+
+# A sink shows or stores notifications. send() gets the problem messages of one digest.
+class LogSink:
+    def send(self, messages):
+        title, body = _digest(messages)
+        logging.info(f"Notification: {title}" + (f"\n{body}" if body else ""))
+
+
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, messages):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {len(messages)} new problems\n")
+            for message in messages:
+                line = message.replace('\n', ' / ')
+                f.write(f"  {line}\n")
+
+
+class ToastSink:
+    def __init__(self, toaster=None):
+        from windows_toasts import Toast
+        self.toast_class = Toast
+        self.toaster = toaster or common.toaster
+
+    def send(self, messages):
+        title, body = _digest(messages)
+        toast = self.toast_class()
+        toast.text_fields = [f"⚠️ {title}", body] if body else [f"⚠️ {title}"]
+
+        def on_click(args):
+            if common.open_log_callback:
+                common.open_log_callback()
+            else:
+                subprocess.Popen(['notepad.exe', str(common.LOG_FILE_PATH)])
+        toast.on_activated = on_click
+        self.toaster.show_toast(toast)
+
+
+# Turns the problems the checks find into notifications. Each check reports the complete set of
+# problems of a source every time it runs; only problems that are new, or whose state changed,
+# since the previous report are notified, so a problem that persists for days is notified once.
+# The known problems are kept in the alerts table and survive restarts. New problems are sent to
+# the sinks as one digest, COALESCE_DELAY seconds after the first of them and at most every
+# min_interval seconds; problems still waiting at shutdown are sent by close().
+class Notifier:
+    def __init__(self, sinks=(), min_interval=DEFAULT_MIN_INTERVAL):
+        self.sinks = list(sinks)
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_sent = None
+        self._timer = None
+
+    def report(self, source, problems):
+        # problems maps a key to the (state, message) of its current problem; keys of the source
+        # that aren't in it are resolved
+        if problems:
+            common.mark_warning()
+        con = db.connect()
+        known = {key: state for key, state in con.execute("SELECT key, state FROM alerts WHERE source = ?", (source,))}
+        changed = [(source, key, state, message, time.time()) for key, (state, message) in problems.items() if known.get(key) != state]
+        resolved = [(source, key) for key in known if key not in problems]
+        if not changed and not resolved:
+            return
+        with con:
+            con.executemany("INSERT OR REPLACE INTO alerts (source, key, state, message, since) VALUES (?, ?, ?, ?, ?)", changed)
+            con.executemany("DELETE FROM alerts WHERE source = ? AND key = ?", resolved)
+        messages = [message for _, _, _, message, _ in changed]
+        for message in messages:
+            logging.warning(message)
+        for _, key in resolved:
+            logging.info(f"Problem resolved: {source} {key}")
+        if messages:
+            self._queue(messages)
+
+    def _queue(self, messages):
+        with self._lock:
+            self._pending.extend(messages)
+            if self._timer is not None:
+                return
+            wait = COALESCE_DELAY
+            if self._last_sent is not None:
+                wait = max(wait, self._last_sent + self.min_interval - time.monotonic())
+            self._timer = threading.Timer(wait, self._flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def close(self):
+        with self._lock:
+            timer = self._timer
+        if timer is not None:
+            timer.cancel()
+        self._flush()
+
+    def prune(self, live):
+        # forgets the problems of sources that are no longer checked, like removed hosts; live maps
+        # each checked source to the keys it can still report, or to None to keep all of its keys
+        con = db.connect()
+        stale = [(source, key) for source, key in con.execute("SELECT source, key FROM alerts")
+                 if source not in live or (live[source] is not None and key not in live[source])]
+        if not stale:
+            return
+        with con:
+            con.executemany("DELETE FROM alerts WHERE source = ? AND key = ?", stale)
+        logging.info(f"Forgot {len(stale)} problems of removed hosts or manifests")
+
+    def _flush(self):
+        with self._lock:
+            messages, self._pending = self._pending, []
+            self._timer = None
+            self._last_sent = time.monotonic()
+        if not messages:
+            return
+        for sink in self.sinks:
+            try:
+                sink.send(messages)
+            except Exception as e:
+                logging.error(f"Failed to send notification to {type(sink).__name__}: {e}")
+
+
+notifier = Notifier([LogSink()])
+
+def report(source, problems):
+    notifier.report(source, problems)
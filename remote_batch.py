@@ -0,0 +1,110 @@
+import os
+import secrets
+import signal
+import sys
+import threading
+import time
+
+import host_checker.common as common
+
+
+# Runs several shell commands on a host in one ssh session. The script goes to the remote shell's
+# stdin and each command's output is framed by marker lines carrying a random token, so stray output
+# (login banners, rc files) and whatever the output itself contains can't be mistaken for a frame.
+# Every frame ends with the command's exit code.
+class RemoteBatch:
+    def __init__(self):
+        self.token = secrets.token_hex(8)
+        self.commands = []
+        self.stderr = ''
+        self.completed = False
+
+    def add(self, name, command, on_line=None):
+        # on_line, if given, is called with each output line of the command as it arrives; the
+        # output isn't kept then, and the command's frame comes with an empty output
+        self.commands.append((name, command, on_line))
+
+    def script(self) -> str:
+        # each command runs in a subshell so a 'cd' or 'exit' doesn't affect the next one, and with
+        # stdin from /dev/null so it can't read the rest of the script
+        return ''.join(f"printf '\\n@@BEGIN {self.token} {name}\\n'\n"
+                       f"( {command}\n) </dev/null\n"
+                       f"printf '\\n@@END {self.token} {name} %s\\n' $?\n"
+                       for name, command, _ in self.commands)
+
+    def run(self, proc, timeout):
+        # Runs the batch in a shell that was started by the caller and stays open for the next
+        # batch, and yields (name, exit code, output) for each command as soon as it finished.
+        # The script is followed by a marker and reading stops there. completed tells whether the
+        # marker was seen; if it wasn't, because of the timeout, a lost connection, a shutdown or the
+        # caller stopping early, the shell is killed, as whatever it still prints would end up in
+        # the next batch. Commands cut off that way are not yielded. Raises Cancelled if the shell
+        # was killed because the app shuts down.
+        self.completed = False
+        script = self.script() + f"printf '\\n@@DONE {self.token}\\n'\n"
+        threading.Thread(target=self._feed, args=(proc, script), daemon=True).start()
+        try:
+            yield from self._frames(proc, timeout)
+            common.check_cancelled()
+        finally:
+            if not self.completed:
+                kill(proc)
+                proc.wait()
+
+    @staticmethod
+    def _feed(proc, script):
+        try:
+            proc.stdin.write(script.encode('utf-8'))
+            proc.stdin.flush()
+        except (OSError, ValueError):
+            pass
+
+    def _frames(self, proc, timeout):
+        handlers = {name: on_line for name, _, on_line in self.commands}
+        begin, end, done = f"@@BEGIN {self.token} ", f"@@END {self.token} ", f"@@DONE {self.token}"
+        finished = threading.Event()
+
+        def watchdog():
+            deadline = time.monotonic() + timeout
+            while not finished.wait(0.1):
+                if common.shutdown_event.is_set() or time.monotonic() >= deadline:
+                    kill(proc)
+                    return
+
+        threading.Thread(target=watchdog, daemon=True).start()
+        try:
+            current = None
+            lines = []
+            for raw in iter(proc.stdout.readline, b''):
+                line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+                if line.startswith(begin):
+                    current, lines = line[len(begin):], []
+                elif line.startswith(end) and current is not None:
+                    name, _, code = line[len(end):].rpartition(' ')
+                    if name == current:
+                        # drop the newline the end marker is printed after
+                        if lines and lines[-1] == '':
+                            lines.pop()
+                        yield name, int(code) if code.isdigit() else -1, '\n'.join(lines)
+                    current = None
+                elif current is not None:
+                    if not handlers.get(current):
+                        lines.append(line)
+                    elif line:
+                        handlers[current](line)
+                elif line == done:
+                    self.completed = True
+                    return
+        finally:
+            finished.set()
+
+
+def kill(proc):
+    if sys.platform == 'win32':
+        proc.kill()
+    else:
+        # the process was started in its own session, so this also stops what it started
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
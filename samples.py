@@ -0,0 +1,97 @@
+import datetime
+import logging
+import re
+import time
+
+import host_checker.common as common
+import host_checker.db as db
+
+_LINE_RE = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d+ - .* - INFO - (.+?): (?:Battery (\d+)% \((.*)\)|Storage (\d+) MB free)$")
+# a storage line logged this soon after a battery line of the same host belongs to the same check
+_MERGE_WINDOW = 120
+_BATCH_SIZE = 10000
+
+
+def record_sample(host, percentage, status, free_mb, ts=None):
+    con = db.connect()
+    with con:
+        con.execute("INSERT OR REPLACE INTO battery_samples (host, ts, percentage, status, free_mb) VALUES (?, ?, ?, ?, ?)",
+                    (host, time.time() if ts is None else ts, percentage, status, free_mb))
+
+def query_samples(host, since=None, until=None) -> list[tuple[float, int, str]]:
+    # (epoch seconds, percentage, status) of the host's battery samples, oldest first
+    sql = "SELECT ts, percentage, status FROM battery_samples WHERE host = ? AND percentage IS NOT NULL"
+    params = [host]
+    if since is not None:
+        sql += " AND ts >= ?"
+        params.append(since)
+    if until is not None:
+        sql += " AND ts <= ?"
+        params.append(until)
+    sql += " ORDER BY ts"
+    return db.connect().execute(sql, params).fetchall()
+
+def import_log(log_path) -> int:
+    # Backfills battery_samples from the "<host>: Battery N% (status)" and "<host>: Storage N MB free"
+    # lines of an existing log. Samples already in the table are kept, so this can be run repeatedly.
+    con = db.connect()
+    pending = {}  # host -> [ts, percentage, status, free_mb] of the last battery line
+    rows = []
+    count = 0
+
+    def flush():
+        nonlocal count
+        with con:
+            count += con.executemany("INSERT OR IGNORE INTO battery_samples (host, ts, percentage, status, free_mb) VALUES (?, ?, ?, ?, ?)", rows).rowcount
+        rows.clear()
+
+    with open(log_path, 'r', encoding='utf-8', errors='ignore') as f:
+        for i, line in enumerate(f):
+            if i % 4096 == 0:
+                common.check_cancelled()
+            if 'INFO' not in line:
+                continue
+            m = _LINE_RE.match(line.rstrip('\n'))
+            if not m:
+                continue
+            dt_str, host, pct_str, status, free_str = m.groups()
+            ts = time.mktime(datetime.datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S").timetuple())
+            if pct_str is not None:
+                prev = pending.pop(host, None)
+                if prev:
+                    rows.append((host, *prev))
+                pending[host] = [ts, int(pct_str), status, None]
+            else:
+                prev = pending.pop(host, None)
+                if prev and ts - prev[0] <= _MERGE_WINDOW:
+                    prev[3] = float(free_str)
+                    rows.append((host, *prev))
+                else:
+                    if prev:
+                        rows.append((host, *prev))
+                    rows.append((host, ts, None, None, float(free_str)))
+            if len(rows) >= _BATCH_SIZE:
+                flush()
+
+    for host, prev in pending.items():
+        rows.append((host, *prev))
+    flush()
+    return count
+
+def import_log_once(log_path):
+    if db.get_setting('samples_log_imported') == '1':
+        return
+    try:
+        start = time.monotonic()
+        count = import_log(log_path)
+        logging.info(f"Imported {count} battery/storage samples from {log_path} in {time.monotonic() - start:.1f}s")
+    except FileNotFoundError:
+        pass
+    except common.Cancelled:
+        # the samples imported so far are kept; the rest is imported on the next start
+        logging.info("Sample import cancelled")
+        return
+    except Exception as e:
+        logging.error(f"Failed to import samples from {log_path}: {e}")
+        return
+    db.set_setting('samples_log_imported', '1')
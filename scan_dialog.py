@@ -0,0 +1,134 @@
+import ipaddress
+import logging
+import queue
+import socket
+import threading
+import tkinter as tk
+from tkinter import messagebox, ttk
+
+from host_checker import db
+from host_checker.subnet_scan import (DEFAULT_SCAN_BANNERS, DEFAULT_SCAN_PORTS, DEFAULT_SCAN_RATE, SubnetScanner, parse_banners,
+                                      parse_ports)
+from ui.tools import Tools
+
+
+class ScanDialog:
+    def __init__(self, parent, db_path, callback):
+        self.top = tk.Toplevel(parent)
+        self.top.title("Auto Scan")
+        self.db_path = db_path
+        self.callback = callback
+        self.scanner = None
+        self.scan_thread = None
+        # (ip, port) pairs found by the scan thread, picked up by the UI thread
+        self.found = queue.Queue()
+        self.added = 0
+
+        tk.Label(self.top, text="Subnet (CIDR):").grid(row=0, column=0, padx=5, pady=5, sticky="e")
+        self.subnet_var = tk.StringVar(value=self.default_subnet())
+        tk.Entry(self.top, textvariable=self.subnet_var, width=30).grid(row=0, column=1, padx=5, pady=5, sticky="w")
+
+        tk.Label(self.top, text="Ports:").grid(row=1, column=0, padx=5, pady=5, sticky="e")
+        self.ports_var = tk.StringVar(value=db.get_setting('scan_ports', DEFAULT_SCAN_PORTS))
+        tk.Entry(self.top, textvariable=self.ports_var, width=30).grid(row=1, column=1, padx=5, pady=5, sticky="w")
+
+        tk.Label(self.top, text="Banner patterns (;):").grid(row=2, column=0, padx=5, pady=5, sticky="e")
+        self.banners_var = tk.StringVar(value=db.get_setting('scan_banners', DEFAULT_SCAN_BANNERS))
+        tk.Entry(self.top, textvariable=self.banners_var, width=30).grid(row=2, column=1, padx=5, pady=5, sticky="w")
+
+        tk.Label(self.top, text="Connects per second:").grid(row=3, column=0, padx=5, pady=5, sticky="e")
+        self.rate_var = tk.StringVar(value=db.get_setting('scan_rate', str(DEFAULT_SCAN_RATE)))
+        tk.Entry(self.top, textvariable=self.rate_var, width=10).grid(row=3, column=1, padx=5, pady=5, sticky="w")
+
+        self.progress = ttk.Progressbar(self.top, length=300, mode='determinate')
+        self.progress.grid(row=4, column=0, columnspan=2, padx=5, pady=5, sticky="we")
+        self.status_lbl = tk.Label(self.top, text="Ready")
+        self.status_lbl.grid(row=5, column=0, columnspan=2, padx=5, pady=2)
+
+        self.start_btn = tk.Button(self.top, text="Start", command=self.start)
+        self.start_btn.grid(row=6, column=0, columnspan=2, pady=10)
+
+        self.top.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.top.transient(parent)
+        Tools.center_window(self.top)
+
+    @staticmethod
+    def default_subnet() -> str:
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect(('10.255.255.255', 1))
+            local_ip = s.getsockname()[0]
+            s.close()
+            return str(ipaddress.IPv4Network(f"{local_ip}/24", strict=False))
+        except Exception:
+            return "192.168.1.0/24"
+
+    def start(self):
+        if self.scanner is not None:
+            self.scanner.cancel()
+            self.start_btn.config(state=tk.DISABLED, text="Cancelling...")
+            return
+        try:
+            network = ipaddress.IPv4Network(self.subnet_var.get().strip(), strict=False)
+            ports = parse_ports(self.ports_var.get())
+            banners = parse_banners(self.banners_var.get())
+            rate = int(self.rate_var.get())
+        except Exception as e:
+            messagebox.showerror("Error", f"Invalid scan settings: {e}", parent=self.top)
+            return
+        db.set_setting('scan_ports', self.ports_var.get().strip())
+        db.set_setting('scan_banners', self.banners_var.get().strip())
+        db.set_setting('scan_rate', rate)
+
+        self.added = 0
+        self.scanner = SubnetScanner(network, ports, banners, lambda ip, port, banner: self.found.put((ip, port)), rate=rate)
+        self.progress.config(maximum=max(1, self.scanner.total), value=0)
+        self.start_btn.config(text="Cancel")
+        logging.info(f"Scanning {network} on ports {ports}...")
+        self.scan_thread = threading.Thread(target=self.run_scan, args=(self.scanner,), name="SubnetScan", daemon=True)
+        self.scan_thread.start()
+        self.poll()
+
+    def run_scan(self, scanner):
+        try:
+            scanner.run()
+        except Exception as e:
+            logging.error(f"Scan failed: {e}")
+
+    def poll(self):
+        # adds the hosts found since the last poll and updates the progress, on the UI thread
+        if not self.top.winfo_exists():
+            return
+        scanning = self.scan_thread.is_alive()
+        hosts = []
+        while not self.found.empty():
+            hosts.append(self.found.get_nowait())
+        if hosts:
+            try:
+                con = db.connect(self.db_path)
+                with con:
+                    self.added += con.executemany("INSERT OR IGNORE INTO hosts (host, battery_threshold, storage_threshold, port) VALUES (?, 15, 1024, ?)",
+                                                  hosts).rowcount
+                self.callback()
+            except Exception as e:
+                logging.error(f"Scan save error: {e}")
+
+        scanner = self.scanner
+        self.progress.config(value=scanner.done)
+        self.status_lbl.config(text=f"{scanner.done} of {scanner.total} probed, {len(scanner.found)} found, {self.added} new")
+        if scanning:
+            self.top.after(200, self.poll)
+        else:
+            self.finish()
+
+    def finish(self):
+        scanner, self.scanner = self.scanner, None
+        state = "cancelled" if scanner.cancelled else "finished"
+        self.start_btn.config(state=tk.NORMAL, text="Start")
+        self.status_lbl.config(text=f"Scan {state}. Found {len(scanner.found)} hosts, {self.added} new.")
+        logging.info(f"Scan {state}: {len(scanner.found)} hosts found, {self.added} added")
+
+    def on_close(self):
+        if self.scanner is not None:
+            self.scanner.cancel()
+        self.top.destroy()
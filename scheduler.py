@@ -0,0 +1,199 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+import host_checker.common as common
+from host_checker.daemon_pool import DaemonThreadPool
+
+DEFAULT_JITTER = 0.1
+
+_current_run = threading.local()
+
+
+def run_forced() -> bool:
+    # True in a job that runs because it was requested with force, like by "Check Now"
+    return getattr(_current_run, 'forced', False)
+
+
+class Job:
+    def __init__(self, key, func, interval, concurrency_class, jitter=DEFAULT_JITTER):
+        self.key = key
+        self.func = func
+        self.interval = interval
+        self.concurrency_class = concurrency_class
+        self.jitter = jitter
+        self.next_due = 0.0
+        self.running = False
+        self.rerun = False
+        self.forced = False
+        self.warned = False
+
+
+# Runs each job on its own interval. Due jobs are kept in a heap ordered by due time and
+# handed to one thread pool per concurrency class, so e.g. a long checksum pass in the
+# 'disk' class never delays battery polls in the 'ssh' class. A job never overlaps with
+# itself; a run requested while it is running is queued and starts right after it.
+# A job function may return the epoch time it wants to run again at, if that is earlier
+# than its interval.
+class Scheduler:
+    def __init__(self, concurrency_limits, on_job_done=None, thread_initializer=None):
+        self._executors = {cls: DaemonThreadPool(max(1, limit), thread_name_prefix=f"Check-{cls}", initializer=thread_initializer)
+                           for cls, limit in concurrency_limits.items()}
+        self._jobs = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.on_job_done = on_job_done
+
+    def set_job(self, key, func, interval, concurrency_class, jitter=DEFAULT_JITTER):
+        # adds a job that is due immediately, or updates the settings of an existing one
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._jobs[key] = Job(key, func, interval, concurrency_class, jitter)
+                self._push(job, time.time())
+            else:
+                if interval < job.interval and not job.running:
+                    self._push(job, min(job.next_due, time.time() + interval))
+                job.func, job.interval, job.concurrency_class, job.jitter = func, interval, concurrency_class, jitter
+        self._wakeup.set()
+
+    def set_concurrency(self, concurrency_class, limit):
+        self._executors[concurrency_class].set_max_workers(max(1, limit))
+
+    def remove_jobs(self, keep):
+        # removes all jobs whose key is not in keep
+        with self._lock:
+            for key in [k for k in self._jobs if k not in keep]:
+                del self._jobs[key]
+
+    def keys(self):
+        with self._lock:
+            return list(self._jobs)
+
+    def any_warned(self) -> bool:
+        with self._lock:
+            return any(job.warned for job in self._jobs.values())
+
+    def run_all_now(self, force=False):
+        with self._lock:
+            now = time.time()
+            for job in self._jobs.values():
+                self._run_soon(job, now, force)
+        self._wakeup.set()
+
+    def run_now(self, key, force=False):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                self._run_soon(job, time.time(), force)
+        self._wakeup.set()
+
+    def _run_soon(self, job, now, force):
+        job.forced = job.forced or force
+        if job.running:
+            job.rerun = True
+        elif job.next_due > now:
+            self._push(job, now)
+
+    def _push(self, job, due):
+        job.next_due = due
+        heapq.heappush(self._heap, (due, next(self._seq), job.key))
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, _, key = heapq.heappop(self._heap)
+            job = self._jobs.get(key)
+            # skip entries of removed jobs and entries superseded by a later push
+            if job is None or job.next_due != when or job.running:
+                continue
+            job.running = True
+            due.append((job, job.forced))
+            job.forced = False
+        return due
+
+    def run_pending(self) -> float:
+        # dispatches all due jobs and returns the seconds until the next one is due
+        now = time.time()
+        with self._lock:
+            due = self._pop_due(now)
+            next_due = self._heap[0][0] if self._heap else now + 3600
+        for job, forced in due:
+            self._executors[job.concurrency_class].submit(self._run_job, job, forced)
+        return max(0.0, next_due - time.time())
+
+    def wait(self, timeout, check_event=None):
+        # waits for the next due job, a job change or, if given, check_event
+        deadline = time.monotonic() + timeout
+        while True:
+            if self._wakeup.is_set():
+                self._wakeup.clear()
+                return
+            if check_event is not None and check_event.is_set():
+                check_event.clear()
+                self.run_all_now(force=True)
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            (check_event or self._wakeup).wait(min(remaining, 1.0))
+
+    def _run_job(self, job, forced=False):
+        common.begin_warning_scope()
+        _current_run.forced = forced
+        start = time.monotonic()
+        wanted = None
+        try:
+            wanted = job.func()
+        except common.Cancelled:
+            logging.info(f"Check {job.key} cancelled")
+        except Exception:
+            logging.exception(f"Check {job.key} failed")
+        finally:
+            _current_run.forced = False
+            warned = common.warning_scope_triggered()
+            logging.debug(f"Check {job.key} finished in {time.monotonic() - start:.1f}s")
+            with self._lock:
+                job.running = False
+                job.warned = warned
+                if self._jobs.get(job.key) is job:
+                    if job.rerun:
+                        job.rerun = False
+                        self._push(job, time.time())
+                    else:
+                        spread = job.interval * job.jitter
+                        now = time.time()
+                        due = now + job.interval + random.uniform(-spread, spread)
+                        if wanted is not None:
+                            due = min(due, max(wanted, now))
+                        self._push(job, due)
+            self._wakeup.set()
+            if self.on_job_done:
+                self.on_job_done(job)
+
+    def shutdown(self, timeout=None):
+        # Drops queued runs and waits for the running ones, at most timeout seconds if given.
+        # Running checks only stop early if they were cancelled through common.shutdown_event;
+        # ones that don't are left behind on their daemon threads and don't keep the app alive.
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        if timeout is None:
+            for executor in self._executors.values():
+                executor.shutdown(wait=True)
+            return
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                running = [job.key for job in self._jobs.values() if job.running]
+            if not running:
+                return
+            if time.monotonic() >= deadline:
+                logging.warning(f"Checks still running at shutdown: {running}")
+                return
+            self._wakeup.wait(0.05)
+            self._wakeup.clear()
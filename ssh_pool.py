@@ -0,0 +1,167 @@
+import collections
+import logging
+import subprocess
+import sys
+import threading
+import time
+
+from host_checker.remote_batch import kill
+
+# sessions are closed this long after their last batch: the keepalives of an open session would
+# wake an idle phone's radio every KEEPALIVE_INTERVAL seconds between host checks
+DEFAULT_IDLE_TIMEOUT = 60
+# ssh gives up on a connection after this many unanswered keepalives, one every interval seconds
+KEEPALIVE_INTERVAL = 15
+KEEPALIVE_COUNT = 3
+# stderr lines of a session kept for the error message when it fails
+STDERR_LINES = 20
+
+
+def _startupinfo():
+    startupinfo = None
+    if sys.platform == 'win32':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return startupinfo
+
+def build_ssh_cmd(host, port=8022, key_file=None, remote_cmd=None, connect_timeout=55, ssh_bin="ssh", extra_opts=()) -> list[str]:
+    cmd = [
+        ssh_bin,
+        "-p", str(port),
+        "-o", f"ConnectTimeout={connect_timeout}",
+        "-o", "BatchMode=yes",
+    ]
+    for opt in extra_opts:
+        cmd.extend(["-o", opt])
+    if key_file:
+        cmd.extend(["-i", key_file])
+    cmd.append(f"root@{host}")
+    if remote_cmd:
+        cmd.append(remote_cmd)
+    return cmd
+
+
+class _Session:
+    def __init__(self):
+        self.proc = None
+        self.stderr = collections.deque(maxlen=STDERR_LINES)
+        self.stderr_reader = None
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+
+# Keeps one authenticated ssh session per host open and runs every batch of commands for the host
+# in it. The session is a plain remote 'sh' reading batches from stdin, which works with any ssh
+# client, including the Windows OpenSSH port that can't multiplex. ssh's keepalives end a session
+# whose connection died; a batch sent to a session that turns out to be gone without running
+# anything is retried once in a new one. Sessions unused for idle_timeout seconds are closed, so
+# a session mostly serves the checks of a host that come in quick succession, like "Check Now".
+class SshSessionPool:
+    def __init__(self, ssh_bin="ssh", idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.ssh_bin = ssh_bin
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def run_batch(self, batch, host, port=8022, key_file=None, connect_timeout=55, timeout=60):
+        # Yields the frames of batch.run(); batch.stderr is set if the session failed.
+        self.evict_idle()
+        key = (host, int(port), key_file or '')
+        with self._lock:
+            session = self._sessions.setdefault(key, _Session())
+
+        deadline = time.monotonic() + timeout
+        with session.lock:
+            while True:
+                reused = session.alive()
+                if not reused:
+                    self._start(session, host, port, key_file, connect_timeout)
+                frames = 0
+                for frame in batch.run(session.proc, max(1.0, deadline - time.monotonic())):
+                    frames += 1
+                    yield frame
+                if batch.completed:
+                    session.last_used = time.monotonic()
+                    return
+                self._stop(session)
+                batch.stderr = '\n'.join(session.stderr)
+                if frames or not reused:
+                    return
+                logging.info(f"ssh session to {host} was lost, reconnecting")
+
+    def _start(self, session, host, port, key_file, connect_timeout):
+        self._stop(session)
+        cmd = build_ssh_cmd(host, port, key_file, "sh", connect_timeout, self.ssh_bin,
+                            extra_opts=(f"ServerAliveInterval={KEEPALIVE_INTERVAL}", f"ServerAliveCountMax={KEEPALIVE_COUNT}"))
+        # own process group, so killing the session also stops anything ssh (or a local stand-in) started
+        session.proc = proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                               startupinfo=_startupinfo(), start_new_session=sys.platform != 'win32')
+        session.stderr.clear()
+
+        def read_stderr():
+            for raw in iter(proc.stderr.readline, b''):
+                session.stderr.append(raw.decode('utf-8', errors='replace').rstrip('\r\n'))
+
+        session.stderr_reader = threading.Thread(target=read_stderr, name=f"ssh-stderr-{host}", daemon=True)
+        session.stderr_reader.start()
+        session.last_used = time.monotonic()
+        logging.info(f"Opened ssh session to {host}")
+
+    def _stop(self, session, graceful=True):
+        proc, reader = session.proc, session.stderr_reader
+        session.proc = session.stderr_reader = None
+        if proc is None:
+            return
+        if proc.poll() is None and not graceful:
+            kill(proc)
+            proc.wait()
+        elif proc.poll() is None:
+            # the remote shell exits at the end of its input
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                kill(proc)
+                proc.wait()
+        if reader is not None:
+            reader.join(5)
+
+    def evict_idle(self):
+        # closes idle sessions; returns the seconds until the next open one becomes idle, or None
+        if self.idle_timeout is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            idle = [(k, s) for k, s in self._sessions.items() if s.proc is not None and now - s.last_used > self.idle_timeout]
+            open_since = [s.last_used for s in self._sessions.values() if s.proc is not None and now - s.last_used <= self.idle_timeout]
+        for key, session in idle:
+            # a session busy with a batch isn't idle
+            if not session.lock.acquire(blocking=False):
+                continue
+            try:
+                if session.proc is not None and now - session.last_used > self.idle_timeout:
+                    logging.info(f"Closing idle ssh session to {key[0]}")
+                    self._stop(session)
+            finally:
+                session.lock.release()
+        if not open_since:
+            return None
+        return max(0.0, min(open_since) + self.idle_timeout - now) + 0.1
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            # sessions still running a batch at shutdown are killed by the batch itself
+            if session.lock.acquire(blocking=False):
+                try:
+                    self._stop(session, graceful=False)
+                finally:
+                    session.lock.release()
@@ -0,0 +1,129 @@
+import asyncio
+import ipaddress
+import re
+import threading
+import time
+
+DEFAULT_SCAN_PORTS = "8022"
+# regular expressions separated by ';', searched in the first bytes a service sends; empty accepts any open port
+DEFAULT_SCAN_BANNERS = "^SSH-"
+DEFAULT_SCAN_RATE = 2000
+DEFAULT_SCAN_MAX_IN_FLIGHT = 2000
+DEFAULT_SCAN_TIMEOUT = 1.0
+BANNER_SIZE = 256
+
+
+def parse_ports(text) -> list[int]:
+    ports = []
+    for part in text.replace(';', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        port = int(part)
+        if not 0 < port < 65536:
+            raise ValueError(f"Invalid port: {port}")
+        ports.append(port)
+    if not ports:
+        raise ValueError("No port given")
+    return ports
+
+def parse_banners(text) -> list[re.Pattern]:
+    return [re.compile(part.strip()) for part in text.split(';') if part.strip()]
+
+def _fd_limit(requested) -> int:
+    # keeps the sockets in flight below the process' open file limit where there is one
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return requested
+    if soft == resource.RLIM_INFINITY:
+        return requested
+    return max(16, min(requested, soft - 64))
+
+
+# Probes every address of a network on the given ports with non-blocking connects on an asyncio
+# loop, so thousands of connects can be in flight at once. Starts at most `rate` connects per
+# second and reports each (ip, port) whose banner matches one of the patterns to on_found as
+# soon as it is found. run() blocks until the scan is done or cancelled; call it on its own
+# thread and cancel() from any thread.
+class SubnetScanner:
+    def __init__(self, network, ports, patterns, on_found, rate=DEFAULT_SCAN_RATE, max_in_flight=DEFAULT_SCAN_MAX_IN_FLIGHT,
+                 timeout=DEFAULT_SCAN_TIMEOUT):
+        self.network = ipaddress.ip_network(network, strict=False) if isinstance(network, str) else network
+        self.ports = list(ports)
+        self.patterns = list(patterns)
+        self.on_found = on_found
+        self.rate = rate
+        self.max_in_flight = _fd_limit(max_in_flight)
+        self.timeout = timeout
+        self.total = self._host_count() * len(self.ports)
+        self.done = 0
+        self.found = []
+        self._cancel = threading.Event()
+
+    def _host_count(self) -> int:
+        # what network.hosts() yields, without enumerating it
+        if self.network.num_addresses <= 2:
+            return self.network.num_addresses
+        return self.network.num_addresses - 2
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def run(self):
+        asyncio.run(self._scan())
+
+    async def _scan(self):
+        slots = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        next_start = time.monotonic()
+        for ip in self.network.hosts():
+            for port in self.ports:
+                if self.cancelled:
+                    break
+                await slots.acquire()
+                if interval:
+                    now = time.monotonic()
+                    next_start = max(next_start, now) + interval
+                    # sleeping per connect is too coarse on most platforms; catch up in small steps
+                    if next_start - now > 0.01:
+                        await asyncio.sleep(next_start - now)
+                task = asyncio.create_task(self._probe(str(ip), port, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if self.cancelled:
+                break
+        if self.cancelled:
+            for task in tasks:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _probe(self, ip, port, slots):
+        try:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), self.timeout)
+            except (OSError, asyncio.TimeoutError):
+                return
+            try:
+                banner = b''
+                if self.patterns:
+                    try:
+                        banner = await asyncio.wait_for(reader.read(BANNER_SIZE), self.timeout)
+                    except (OSError, asyncio.TimeoutError):
+                        return
+                    text = banner.decode('latin-1')
+                    if not any(pattern.search(text) for pattern in self.patterns):
+                        return
+                self.found.append((ip, port))
+                self.on_found(ip, port, banner)
+            finally:
+                writer.close()
+        finally:
+            self.done += 1
+            slots.release()
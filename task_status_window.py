@@ -1,9 +1,9 @@
 import datetime
 import logging
-import sqlite3
 import tkinter as tk
 from tkinter import messagebox, ttk
 
+from host_checker import db
 from ui.tools import Tools
 
 
@@ -53,7 +53,7 @@ class TaskStatusWindow:
         self.on_select(None)
         
         try:
-            con = sqlite3.connect(str(self.db_path))
+            con = db.connect(self.db_path)
             cur = con.cursor()
             cur.execute("SELECT filename, timeout_hours, last_run, status FROM task_status")
             for row in cur.fetchall():
@@ -67,7 +67,6 @@ class TaskStatusWindow:
                         dt_str = str(last_run)
                 
                 self.tree.insert('', tk.END, values=(filename, timeout, dt_str, status))
-            con.close()
         except Exception as e:
             logging.error(f"Failed to load DB: {e}")
             
@@ -110,7 +109,7 @@ class TaskStatusWindow:
                 return
 
             try:
-                con = sqlite3.connect(str(self.db_path))
+                con = db.connect(self.db_path)
                 with con:
                     if new_filename != old_filename:
                         cur = con.cursor()
@@ -121,7 +120,6 @@ class TaskStatusWindow:
                         con.execute("UPDATE task_status SET filename = ?, timeout_hours = ? WHERE filename = ?", (new_filename, new_timeout, old_filename))
                     else:
                         con.execute("UPDATE task_status SET timeout_hours = ? WHERE filename = ?", (new_timeout, old_filename))
-                con.close()
                 self.load_data()
                 dlg.destroy()
             except Exception as e:
@@ -137,13 +135,12 @@ class TaskStatusWindow:
             return
             
         try:
-            con = sqlite3.connect(str(self.db_path))
+            con = db.connect(self.db_path)
             with con:
                 for item in selected:
                     values = self.tree.item(item, 'values')
                     filename = values[0]
                     con.execute("DELETE FROM task_status WHERE filename = ?", (filename,))
-            con.close()
             self.load_data()
         except Exception as e:
             messagebox.showerror("Error", str(e))
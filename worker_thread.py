@@ -1,10 +1,22 @@
+import functools
 import logging
 import threading
+import time
 
 import pythoncom
 
 import host_checker.checks as checks
 import host_checker.common as common
+import host_checker.db as db
+import host_checker.notifications as notifications
+import host_checker.samples as samples
+from host_checker.dir_watcher import DirWatcher
+from host_checker.scheduler import Scheduler
+
+# how often the job list is re-read from the hosts table and settings
+SYNC_INTERVAL = 60
+# how long quitting waits for running checks to notice the shutdown
+SHUTDOWN_TIMEOUT = 1.0
 
 
 class WorkerThread(threading.Thread):
@@ -13,38 +25,103 @@ class WorkerThread(threading.Thread):
         self.icon = icon
         self.check_event = check_event
         self.shutdown_event = shutdown_event
+        self.scheduler = None
+        # task status files changed since the last task check; None means all need to be read
+        self.task_changes = None
+        self.task_changes_lock = threading.Lock()
+        self.task_watcher_thread = None
 
     def run(self):
         logging.info("Worker thread started.")
         pythoncom.CoInitialize()
         try:
+            samples.import_log_once(common.LOG_FILE_PATH)
+            concurrency = checks.get_int_setting('host_check_concurrency', checks.DEFAULT_HOST_CHECK_CONCURRENCY)
+            self.scheduler = Scheduler({'ssh': concurrency, 'local': 1, 'disk': 1},
+                                       on_job_done=self.on_job_done, thread_initializer=pythoncom.CoInitialize)
+            self.task_watcher_thread = threading.Thread(target=self.watch_tasks, name="TaskWatcher", daemon=True)
+            self.task_watcher_thread.start()
+            last_sync = 0
             while not self.shutdown_event.is_set():
-                logging.info("Starting checks...")
-                common.warning_triggered = False
-                
-                current_hosts = checks.get_monitored_hosts()
-                key_file = checks.get_ssh_key_path()
-                for host_data in current_hosts:
-                    if self.shutdown_event.is_set(): break
-                    host = host_data[0]
-                    batt = host_data[1] if host_data[1] is not None else 15
-                    store = host_data[2] if host_data[2] is not None else 1024
-                    port = host_data[3] if len(host_data) > 3 and host_data[3] is not None else 8022
-                    checks.check_host(host, port, batt, store, key_file)
-
-                if self.shutdown_event.is_set(): break
-                checks.check_task_execution()
-                
-                if self.shutdown_event.is_set(): break
-                checks.check_checksums()
-                
-                if common.warning_triggered:
-                    self.icon.icon = common.create_icon('error')
-                else:
-                    self.icon.icon = common.create_icon('ok')
-                    
-                self.check_event.wait(1800)
-                self.check_event.clear()
+                if time.monotonic() - last_sync >= SYNC_INTERVAL:
+                    self.sync_jobs()
+                    last_sync = time.monotonic()
+                idle_in = checks.ssh_sessions.evict_idle()
+                timeout = self.scheduler.run_pending()
+                self.scheduler.wait(min(timeout, SYNC_INTERVAL, idle_in if idle_in is not None else SYNC_INTERVAL), self.check_event)
         finally:
+            if self.scheduler:
+                self.scheduler.shutdown(SHUTDOWN_TIMEOUT)
+            checks.ssh_sessions.close_all()
+            notifications.notifier.close()
+            db.close()
             pythoncom.CoUninitialize()
-            logging.info("Worker thread stopped.")
\ No newline at end of file
+            logging.info("Worker thread stopped.")
+
+    def sync_jobs(self):
+        self.scheduler.set_concurrency('ssh', checks.get_int_setting('host_check_concurrency', checks.DEFAULT_HOST_CHECK_CONCURRENCY))
+        checks.ssh_sessions.ssh_bin = checks.get_setting('ssh_command', 'ssh')
+        notifications.notifier.min_interval = checks.get_int_setting('notify_min_interval', notifications.DEFAULT_MIN_INTERVAL)
+        key_file = checks.get_ssh_key_path()
+        timeout = checks.get_int_setting('host_check_timeout', checks.DEFAULT_HOST_CHECK_TIMEOUT)
+        host_interval = checks.get_int_setting('host_check_interval', checks.DEFAULT_HOST_CHECK_INTERVAL, checks.MIN_CHECK_INTERVAL)
+
+        keys = set()
+        sources = {'tasks': None}
+        for host_data in checks.get_monitored_hosts():
+            host = host_data[0]
+            sources[f"battery:{host}"] = sources[f"storage:{host}"] = None
+            batt = host_data[1] if host_data[1] is not None else 15
+            store = host_data[2] if host_data[2] is not None else 1024
+            port = host_data[3] if len(host_data) > 3 and host_data[3] is not None else 8022
+            key = ('host', host)
+            keys.add(key)
+            self.scheduler.set_job(key, functools.partial(checks.check_host, host, port, batt, store, key_file, timeout), host_interval, 'ssh')
+
+        keys.add(('tasks',))
+        self.scheduler.set_job(('tasks',), self.check_tasks,
+                               checks.get_int_setting('task_check_interval', checks.DEFAULT_TASK_CHECK_INTERVAL, checks.MIN_CHECK_INTERVAL), 'local')
+        keys.add(('checksums',))
+        self.scheduler.set_job(('checksums',), checks.check_checksums,
+                               checks.get_int_setting('checksum_check_interval', checks.DEFAULT_CHECKSUM_CHECK_INTERVAL, checks.MIN_CHECK_INTERVAL), 'disk')
+        self.scheduler.remove_jobs(keys)
+        sources['checksums'] = {f"{h}:{p}" for p, h in db.connect().execute("SELECT path, host FROM checksum_files")}
+        notifications.notifier.prune(sources)
+
+    def watch_tasks(self):
+        # re-checks tasks as soon as their status files change; the scheduled task check then only
+        # has to read the changed files and look for tasks that went stale
+        try:
+            watcher = DirWatcher(common.LOG_DIR_PATH, '.status')
+        except Exception:
+            logging.exception("Failed to watch task status files")
+            return
+        logging.info(f"Watching task status files ({watcher.method})")
+        try:
+            while not self.shutdown_event.is_set():
+                changed = watcher.changes(1.0)
+                if changed is None or changed:
+                    with self.task_changes_lock:
+                        if changed is None:
+                            self.task_changes = None
+                        elif self.task_changes is not None:
+                            self.task_changes |= changed
+                    self.scheduler.run_now(('tasks',))
+        except Exception:
+            logging.exception("Task status watcher failed")
+        finally:
+            watcher.close()
+
+    def check_tasks(self):
+        with self.task_changes_lock:
+            changed = self.task_changes
+            self.task_changes = set()
+        if not self.task_watcher_thread.is_alive():
+            changed = None
+        return checks.check_task_execution(changed)
+
+    def on_job_done(self, job):
+        if self.scheduler.any_warned():
+            self.icon.icon = common.create_icon('error')
+        else:
+            self.icon.icon = common.create_icon('ok')